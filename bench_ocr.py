@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark the OCR backends on the fields of a recording
+Record one with: python main.py --record <dir>
+Every text field is cropped from every frame. By default the int8 reader
+easyocr runs on CPU is checked against a full precision one: how often they
+agree and how long each takes. With --route every backend reads every field
+it supports, and the ones agreeing with easyocr whenever they're sure are
+saved, fastest first, as the field's route in ocr_routes.json.
+Usage: python bench_ocr.py <frames dir or .zip> [--passes N] [--route]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import re
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from utils.screenshot import ReplayFrameSource, set_frame_source, capture_frame
+import core.ocr as ocr
+from core.ocr import build_reader, recognize_field, FIELDS, OcrCache
+from core.ocr_backends import BACKENDS, FALLBACK_BACKEND, ROUTED_FIELDS, OCR_ROUTES_PATH
+from core.state import field_crops
+from core.vocab import label_from_text
+
+# share of crops the int8 reader has to read the same as the full precision one
+MIN_PARITY = 0.98
+# share of a backend's sure readings that have to match easyocr's for it to be routed
+MIN_ROUTE_ACCURACY = 0.99
+
+def collect_crops(path, fields):
+  """[(field, crop)] of the fields on every recorded frame."""
+  source = ReplayFrameSource(path)
+  set_frame_source(source)
+  crops = []
+  for _ in range(len(source)):
+    capture_frame()
+    for field in fields:
+      crops.extend((field, np.array(img)) for img in field_crops(field))
+  source.close()
+  return crops
+
+def ms(values):
+  return f"avg {np.mean(values) * 1000:7.1f} ms  p95 {np.percentile(values, 95) * 1000:7.1f} ms"
+
+def read_all(reader, crops, passes):
+  """Texts of the crops and the seconds each read took, per field."""
+  texts = []
+  timings = defaultdict(list)
+  for field, img in crops:
+    for _ in range(passes):
+      start = time.perf_counter()
+      text, _ = recognize_field(img, field, reader)
+      timings[field].append(time.perf_counter() - start)
+    texts.append(" ".join(text.split()))
+  return texts, timings
+
+def check_quantized(path, passes):
+  crops = collect_crops(path, FIELDS)
+  print(f"{len(crops)} crops from {path}")
+  float_texts, float_timings = read_all(build_reader(quantize=False), crops, passes)
+  quantized_texts, quantized_timings = read_all(build_reader(quantize=True), crops, passes)
+
+  agree = defaultdict(int)
+  total = defaultdict(int)
+  for (field, _), full, quantized in zip(crops, float_texts, quantized_texts):
+    total[field] += 1
+    if full == quantized:
+      agree[field] += 1
+    else:
+      print(f"  {field:<10} float {full!r:<30} int8 {quantized!r}")
+
+  print("\n=== Parity and latency ===")
+  for field in FIELDS:
+    if not total[field]:
+      continue
+    speedup = np.mean(float_timings[field]) / np.mean(quantized_timings[field])
+    print(f"  {field:<10} {agree[field]:>4}/{total[field]:<4} same   float {ms(float_timings[field])}"
+          f"   int8 {ms(quantized_timings[field])}   x{speedup:.2f}")
+
+  parity = sum(agree.values()) / len(crops) if crops else 0.0
+  verdict = "OK" if parity >= MIN_PARITY else "TOO DIFFERENT, int8 misreads this recording"
+  print(f"\nParity {parity:.1%} (needs {MIN_PARITY:.0%}): {verdict}")
+  return parity >= MIN_PARITY
+
+def normalize(field, text):
+  """What a reading of the field means, so backends are compared on that rather than on spacing or case."""
+  if field in ("mood", "year", "turn"):
+    label = label_from_text(text, field)
+    if label is not None:
+      return label.value
+  if field == "failure":
+    chance = re.search(r"(\d{1,3})\s*%", text)
+    return chance.group(1) if chance else ""
+  if field in ("stat", "skill_pts", "turn"):
+    return re.sub(r"[^\d]", "", text)
+  return " ".join(text.lower().split())
+
+def timed_reads(backend, images, field, passes):
+  """A backend's readings of a field's crops and the seconds each read took."""
+  readings = []
+  timings = []
+  for img in images:
+    for _ in range(passes):
+      start = time.perf_counter()
+      reading = backend.read(img, field)
+      timings.append(time.perf_counter() - start)
+    readings.append(reading)
+  return readings, timings
+
+def build_routes(path, passes):
+  # every read has to reach its backend, the OCR cache would answer repeated crops
+  ocr.ocr_cache = OcrCache(path=None, max_memory=0)
+  crops = defaultdict(list)
+  for field, img in collect_crops(path, ROUTED_FIELDS):
+    crops[field].append(img)
+  print(f"{sum(len(images) for images in crops.values())} crops from {path}")
+  fallback = BACKENDS[FALLBACK_BACKEND]
+
+  routes = {}
+  report = {}
+  print("\n=== Backends per field (accuracy is against easyocr) ===")
+  for field in ROUTED_FIELDS:
+    images = crops[field]
+    if not images:
+      print(f"  {field:<14} no crops, keeping the default route")
+      continue
+    fallback_readings, fallback_timings = timed_reads(fallback, images, field, passes)
+    reference = [normalize(field, text) for text, _ in fallback_readings]
+    report[field] = {FALLBACK_BACKEND: {"avg_ms": np.mean(fallback_timings) * 1000}}
+    print(f"  {field:<14} {FALLBACK_BACKEND:<10} {len(images):>4} crops  {ms(fallback_timings)}")
+
+    candidates = []
+    for name, backend in BACKENDS.items():
+      if name == FALLBACK_BACKEND or not backend.supports(field) or not backend.available():
+        continue
+      readings, timings = timed_reads(backend, images, field, passes)
+      sure = correct = 0
+      for reading, expected in zip(readings, reference):
+        if backend.accepts(reading, field):
+          sure += 1
+          correct += normalize(field, reading[0]) == expected
+      accuracy = correct / sure if sure else 0.0
+      report[field][name] = {"coverage": sure / len(images), "accuracy": accuracy, "avg_ms": np.mean(timings) * 1000}
+      routed = sure and accuracy >= MIN_ROUTE_ACCURACY
+      print(f"  {'':<14} {name:<10} {sure:>4} sure  {accuracy:7.1%} right  {ms(timings)}"
+            f"{'' if routed else '   not routed'}")
+      if routed:
+        candidates.append((np.mean(timings), name))
+    routes[field] = [name for _, name in sorted(candidates)] + [FALLBACK_BACKEND]
+
+  with open(OCR_ROUTES_PATH, "w", encoding="utf-8") as file:
+    json.dump({"routes": routes, "benchmark": report}, file, indent=2)
+  print(f"\nSaved routes to {OCR_ROUTES_PATH}:")
+  for field, names in routes.items():
+    print(f"  {field:<14} {' -> '.join(names)}")
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the OCR backends on a recording")
+  parser.add_argument("path", help="directory or .zip of recorded PNG frames")
+  parser.add_argument("--passes", type=int, default=3, help="reads of every crop timed per reader")
+  parser.add_argument("--route", action="store_true", help="measure every backend and save the fastest accurate routes")
+  args = parser.parse_args()
+
+  if args.route:
+    build_routes(args.path, args.passes)
+  else:
+    sys.exit(0 if check_quantized(args.path, args.passes) else 1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Build the glyph atlas the numeric HUD fields are read with, from recorded frames
+Record frames with: python main.py --record <dir>
+Every field OCR reads with high confidence, and splits into as many glyphs as
+characters, adds its glyphs to the atlas.
+Usage: python build_glyph_atlas.py <frames dir or .zip> [-o glyph_atlas.npz]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import re
+from collections import Counter
+
+from utils.screenshot import ReplayFrameSource, set_frame_source, capture_frame
+from core.glyphs import GlyphAtlas, GLYPH_ATLAS_PATH, segment
+from core.ocr import get_reader
+from core.state import field_crops
+
+MIN_LABEL_CONFIDENCE = 0.9
+
+# field: (OCR allowlist, pattern the glyphs' text is taken from)
+LABEL_SOURCES = {
+  "stat": ("0123456789", r"\d+"),
+  "skill_pts": ("0123456789", r"\d+"),
+  "turn": (None, r"\d+"),
+}
+
+def label(img, allowlist, pattern):
+  """Text OCR reads in the crop if it's sure of it, else None."""
+  result = get_reader().readtext(img, allowlist=allowlist)
+  for _, text, confidence in result:
+    found = re.search(pattern, text.replace(" ", ""))
+    if found and confidence >= MIN_LABEL_CONFIDENCE:
+      return found.group(0)
+  return None
+
+def main():
+  parser = argparse.ArgumentParser(description="Build the glyph atlas from recorded frames")
+  parser.add_argument("path", help="directory or .zip of recorded PNG frames")
+  parser.add_argument("-o", "--output", default=GLYPH_ATLAS_PATH, help="where to save the atlas")
+  args = parser.parse_args()
+
+  source = ReplayFrameSource(args.path)
+  set_frame_source(source)
+  atlas = GlyphAtlas()
+  used = Counter()
+  skipped = Counter()
+  for _ in range(len(source)):
+    capture_frame()
+    for field, (allowlist, pattern) in LABEL_SOURCES.items():
+      for img in field_crops(field):
+        text = label(img, allowlist, pattern)
+        glyphs = segment(img, field)
+        if text is None or len(glyphs) != len(text):
+          skipped[field] += 1
+          continue
+        for glyph, char in zip(glyphs, text):
+          atlas.add(field, char, glyph)
+        used[field] += 1
+
+  atlas.save(args.output)
+  print(f"Saved {len(atlas)} glyphs to {args.output}")
+  for field in LABEL_SOURCES:
+    labels = sorted(set(atlas.fields.get(field, ([], None))[0]))
+    print(f"  {field:<10} {used[field]:>4} crops used, {skipped[field]:>4} skipped, glyphs: {' '.join(labels)}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Build the label bank mood, year and Race Day are recognized with, from recorded frames
+Record frames with: python main.py --record <dir>
+Every crop OCR reads with high confidence as one of the field's values is
+added to the bank as a rendering of that value.
+Usage: python build_label_bank.py <frames dir or .zip> [-o label_bank.npz]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+from collections import Counter
+
+from utils.screenshot import ReplayFrameSource, set_frame_source, capture_frame
+from core.vocab import LabelBank, LABEL_BANK_PATH, VOCABULARIES, label_from_text
+from core.ocr import read_field
+from core.state import field_crop
+
+MIN_LABEL_CONFIDENCE = 0.9
+
+def main():
+  parser = argparse.ArgumentParser(description="Build the label bank from recorded frames")
+  parser.add_argument("path", help="directory or .zip of recorded PNG frames")
+  parser.add_argument("-o", "--output", default=LABEL_BANK_PATH, help="where to save the bank")
+  args = parser.parse_args()
+
+  source = ReplayFrameSource(args.path)
+  set_frame_source(source)
+  bank = LabelBank()
+  used = Counter()
+  skipped = Counter()
+  for _ in range(len(source)):
+    capture_frame()
+    for field in VOCABULARIES:
+      img = field_crop(field)
+      text, confidence = read_field(img, field)
+      label = label_from_text(text, field)
+      if label is None or confidence < MIN_LABEL_CONFIDENCE:
+        skipped[field] += 1
+        continue
+      bank.add(field, label, img)
+      used[field] += 1
+
+  bank.save(args.output)
+  print(f"Saved {len(bank)} renderings to {args.output}")
+  for field, vocabulary in VOCABULARIES.items():
+    seen = set(bank.fields.get(field, ([], None))[0])
+    print(f"  {field:<6} {used[field]:>4} crops used, {skipped[field]:>4} skipped, {len(seen)} of {len(vocabulary)} values seen")
+
+if __name__ == "__main__":
+  main()
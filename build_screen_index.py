@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Build the screen classifier's index from recorded frames sorted by screen
+Record frames with: python main.py --record <dir>, then move them into one
+folder (or .zip) per screen: lobby, training, race_list, race_result, event,
+skill_list, full_stats, loading
+Usage: python build_screen_index.py <sorted frames dir> [-o screen_index.npz]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+from collections import Counter
+
+from core.screen import ScreenIndex, Fingerprint, SCREEN_INDEX_PATH, MAX_DISTANCE
+
+def main():
+  parser = argparse.ArgumentParser(description="Index recorded frames for the screen classifier")
+  parser.add_argument("path", help="directory with one folder or .zip of PNG frames per screen")
+  parser.add_argument("-o", "--output", default=SCREEN_INDEX_PATH, help="where to save the index")
+  args = parser.parse_args()
+
+  index = ScreenIndex.build(args.path)
+  if not len(index):
+    print(f"No frames found under {args.path}")
+    return
+  index.save(args.output)
+
+  counts = Counter(index.labels)
+  print(f"Indexed {len(index)} frames into {args.output}")
+  for label, count in sorted(counts.items()):
+    print(f"  {label:<12} {count}")
+
+  # leave one out: classify every frame against all the others
+  wrong = Counter()
+  unknown = Counter()
+  for i, label in enumerate(index.labels):
+    nearest, distance = index.nearest(Fingerprint(index.bits[i], index.anchors[i]), exclude=i)
+    if distance > MAX_DISTANCE:
+      unknown[label] += 1
+    elif nearest != label:
+      wrong[label] += 1
+  print("\n=== Leave one out check ===")
+  for label in sorted(counts):
+    print(f"  {label:<12} wrong {wrong[label]:>4}   unknown {unknown[label]:>4}   of {counts[label]}")
+
+if __name__ == "__main__":
+  main()
@@ -1,20 +1,26 @@
 import pyautogui
 from utils.tools import sleep, get_secs, drag_scroll
-from PIL import ImageGrab
+from utils.screenshot import capture_frame, invalidate_frame, region_to_bbox, capture_stats, reset_capture_stats
 
 pyautogui.useImageNotFoundException(False)
 
 import re
+import time
 import core.state as state
-from core.state import check_support_card, check_failure, check_turn, check_mood, check_current_year, check_criteria, check_skill_pts, check_energy_level, get_race_type, check_status_effects
+from core.state import check_support_card, check_failure, check_turn, check_mood, check_current_year, submit_criteria, check_skill_pts, check_energy_level, get_race_type, check_status_effects
 from core.logic import do_something
 
 from utils.log import info, warning, error, debug
 import utils.constants as constants
 
+from core.templates import get_template
 from core.recognizer import is_btn_active, match_template, multi_match_templates
+from core.locator import locator
+from core.screen import classify_screen, ChangeDetector, MOVING, UNCHANGED
+from core.governor import PollGovernor
 from utils.scenario import ura
 from core.skill import buy_skill
+from core.ocr import ocr_cache
 import cv2
 from utils.debug_mode import (
     DEBUG_MODE, enable_debug_mode, disable_debug_mode,
@@ -22,23 +28,12 @@ from utils.debug_mode import (
     log_message, save_debug_screenshot
 )
 
-templates = {
-  "event": "assets/icons/event_choice_1.png",
-  "inspiration": "assets/buttons/inspiration_btn.png",
-  "next": "assets/buttons/next_btn.png",
-  "next2": "assets/buttons/next2_btn.png",
-  "cancel": "assets/buttons/cancel_btn.png",
-  "tazuna": "assets/ui/tazuna_hint.png",
-  "infirmary": "assets/buttons/infirmary_btn.png",
-  "retry": "assets/buttons/retry_btn.png"
-}
-
 training_types = {
-  "spd": "assets/icons/train_spd.png",
-  "sta": "assets/icons/train_sta.png",
-  "pwr": "assets/icons/train_pwr.png",
-  "guts": "assets/icons/train_guts.png",
-  "wit": "assets/icons/train_wit.png"
+  "spd": get_template("assets/icons/train_spd.png"),
+  "sta": get_template("assets/icons/train_sta.png"),
+  "pwr": get_template("assets/icons/train_pwr.png"),
+  "guts": get_template("assets/icons/train_guts.png"),
+  "wit": get_template("assets/icons/train_wit.png")
 }
 
 def click(img: str = None, confidence: float = 0.8, minSearch:float = 2, click: int = 1, text: str = "", boxes = None, region=None):
@@ -73,6 +68,7 @@ def click(img: str = None, confidence: float = 0.8, minSearch:float = 2, click:
 
     pyautogui.moveTo(center[0], center[1], duration=0.225)
     pyautogui.click(clicks=click, interval=0.15)
+    invalidate_frame()
     return True
 
   if img is None:
@@ -82,21 +78,19 @@ def click(img: str = None, confidence: float = 0.8, minSearch:float = 2, click:
   if DEBUG_MODE:
     log_message(f"Searching for button: {img} (confidence={confidence}, region={region})")
 
-  if region:
-    btn = pyautogui.locateCenterOnScreen(img, confidence=confidence, minSearchTime=minSearch, region=region)
-  else:
-    btn = pyautogui.locateCenterOnScreen(img, confidence=confidence, minSearchTime=minSearch)
+  btn = locator.wait_for(img, timeout=minSearch, region=region, confidence=confidence)
   if btn:
     if text:
       debug(text)
 
     # Debug: Log successful click
     if DEBUG_MODE:
-      log_message(f"Button found at: {btn}")
+      log_message(f"Button found at: {btn.center}")
       wait_for_step()
 
-    pyautogui.moveTo(btn, duration=0.225)
+    pyautogui.moveTo(btn.center, duration=0.225)
     pyautogui.click(clicks=click, interval=0.15)
+    invalidate_frame()
     return True
 
   # Debug: Log failed search
@@ -108,6 +102,10 @@ def click(img: str = None, confidence: float = 0.8, minSearch:float = 2, click:
 def go_to_training():
   return click("assets/buttons/training_btn.png")
 
+def training_frame_bboxes():
+  # regions are resolved at call time since the emulator offset moves them
+  return [state.support_panel_bbox(), region_to_bbox(constants.FAILURE_REGION)]
+
 def check_training():
   if state.stop_event.is_set():
     return {}
@@ -123,14 +121,16 @@ def check_training():
   # failcheck enum "train","no_train","check_all"
   failcheck="check_all"
   margin=5
-  for key, icon_path in training_types.items():
+  for key, icon in training_types.items():
     if state.stop_event.is_set():
       return {}
 
-    pos = pyautogui.locateCenterOnScreen(icon_path, confidence=0.8, region=constants.SCREEN_BOTTOM_REGION)
-    if pos:
-      pyautogui.moveTo(pos, duration=0.1)
+    btn = locator.find(icon, region=constants.SCREEN_BOTTOM_REGION)
+    if btn:
+      pyautogui.moveTo(btn.center, duration=0.1)
       pyautogui.mouseDown()
+      # one grab covering the support panel and the failure text of this training
+      capture_frame(training_frame_bboxes())
       support_card_results = check_support_card()
 
       if key != "wit":
@@ -161,15 +161,16 @@ def check_training():
       sleep(0.1)
 
   pyautogui.mouseUp()
+  invalidate_frame()
   click(img="assets/buttons/back_btn.png")
   return results
 
 def do_train(train):
   if state.stop_event.is_set():
     return
-  train_btn = pyautogui.locateOnScreen(f"assets/icons/train_{train}.png", confidence=0.8, region=constants.SCREEN_BOTTOM_REGION)
+  train_btn = locator.find(training_types[train], region=constants.SCREEN_BOTTOM_REGION)
   if train_btn:
-    click(boxes=train_btn, click=3)
+    click(boxes=train_btn.box, click=3)
 
 def do_rest(energy_level):
   if state.stop_event.is_set():
@@ -177,31 +178,25 @@ def do_rest(energy_level):
   if state.NEVER_REST_ENERGY > 0 and energy_level > state.NEVER_REST_ENERGY:
     info(f"Wanted to rest when energy was above {state.NEVER_REST_ENERGY}, retrying from beginning.")
     return
-  rest_btn = pyautogui.locateOnScreen("assets/buttons/rest_btn.png", confidence=0.8, region=constants.SCREEN_BOTTOM_REGION)
-  rest_summber_btn = pyautogui.locateOnScreen("assets/buttons/rest_summer_btn.png", confidence=0.8, region=constants.SCREEN_BOTTOM_REGION)
-
+  rest_btn = locator.wait_for(["assets/buttons/rest_btn.png", "assets/buttons/rest_summer_btn.png"],
+                              region=constants.SCREEN_BOTTOM_REGION)
   if rest_btn:
-    click(boxes=rest_btn)
-  elif rest_summber_btn:
-    click(boxes=rest_summber_btn)
+    click(boxes=rest_btn.box)
 
 def do_recreation():
   if state.stop_event.is_set():
     return
-  recreation_btn = pyautogui.locateOnScreen("assets/buttons/recreation_btn.png", confidence=0.8, region=constants.SCREEN_BOTTOM_REGION)
-  recreation_summer_btn = pyautogui.locateOnScreen("assets/buttons/rest_summer_btn.png", confidence=0.8, region=constants.SCREEN_BOTTOM_REGION)
-
+  recreation_btn = locator.wait_for(["assets/buttons/recreation_btn.png", "assets/buttons/rest_summer_btn.png"],
+                                    region=constants.SCREEN_BOTTOM_REGION)
   if recreation_btn:
-    click(boxes=recreation_btn)
-  elif recreation_summer_btn:
-    click(boxes=recreation_summer_btn)
+    click(boxes=recreation_btn.box)
 
 def do_race(prioritize_g1 = False, img = None):
   if state.stop_event.is_set():
     return False
   click(img="assets/buttons/races_btn.png", minSearch=get_secs(10))
 
-  consecutive_cancel_btn = pyautogui.locateCenterOnScreen("assets/buttons/cancel_btn.png", minSearchTime=get_secs(0.7), confidence=0.8)
+  consecutive_cancel_btn = locator.wait_for("assets/buttons/cancel_btn.png", timeout=get_secs(0.7))
   if state.CANCEL_CONSECUTIVE_RACE and consecutive_cancel_btn:
     click(img="assets/buttons/cancel_btn.png", text="[INFO] Already raced 3+ times consecutively. Cancelling race and doing training.")
     return False
@@ -272,16 +267,16 @@ def race_select(prioritize_g1 = False, img = None):
     for i in range(4):
       if state.stop_event.is_set():
         return False
-      match_aptitude = pyautogui.locateOnScreen("assets/ui/match_track.png", confidence=0.8, minSearchTime=get_secs(0.7))
+      match_aptitude = locator.wait_for("assets/ui/match_track.png", timeout=get_secs(0.7))
 
       if match_aptitude:
         # locked avg brightness = 163
         # unlocked avg brightness = 230
-        if not is_btn_active(match_aptitude, treshold=200):
+        if not is_btn_active(match_aptitude.box, treshold=200):
           info("Race found, but it's locked.")
           return False
         info("Race found.")
-        click(boxes=match_aptitude)
+        click(boxes=match_aptitude.box)
 
         for i in range(2):
           if state.stop_event.is_set():
@@ -323,7 +318,7 @@ def race_prep():
       click(img="assets/buttons/confirm_btn.png", minSearch=get_secs(2), region=constants.SCREEN_MIDDLE_REGION)
       PREFERRED_POSITION_SET = True
 
-  view_result_btn = pyautogui.locateCenterOnScreen("assets/buttons/view_results.png", confidence=0.8, minSearchTime=get_secs(10), region=constants.SCREEN_BOTTOM_REGION)
+  locator.wait_for("assets/buttons/view_results.png", timeout=get_secs(10), region=constants.SCREEN_BOTTOM_REGION)
   click("assets/buttons/view_results.png", click=3)
   sleep(0.5)
   pyautogui.click()
@@ -335,7 +330,7 @@ def race_prep():
     pyautogui.tripleClick(interval=0.2)
     sleep(0.5)
   pyautogui.click()
-  next_button = pyautogui.locateCenterOnScreen("assets/buttons/next_btn.png", confidence=0.9, minSearchTime=get_secs(4), region=constants.SCREEN_BOTTOM_REGION)
+  next_button = locator.wait_for("assets/buttons/next_btn.png", timeout=get_secs(4), region=constants.SCREEN_BOTTOM_REGION, confidence=0.9)
   if not next_button:
     info(f"Wouldn't be able to move onto the after race since there's no next button.")
     if click("assets/buttons/race_btn.png", confidence=0.8, minSearch=get_secs(10), region=constants.SCREEN_BOTTOM_REGION):
@@ -345,32 +340,27 @@ def race_prep():
         info("Couldn't find \"Race!\" button, looking for alternative version.")
         click("assets/buttons/race_exclamation_btn_portrait.png", confidence=0.8, minSearch=get_secs(10))
       sleep(0.5)
-      skip_btn = pyautogui.locateOnScreen("assets/buttons/skip_btn.png", confidence=0.8, minSearchTime=get_secs(2), region=constants.SCREEN_BOTTOM_REGION)
-      skip_btn_big = pyautogui.locateOnScreen("assets/buttons/skip_btn_big.png", confidence=0.8, minSearchTime=get_secs(2), region=constants.SKIP_BTN_BIG_REGION_LANDSCAPE)
-      if not skip_btn_big and not skip_btn:
+      # portrait and landscape skip buttons, whichever shows up first
+      skip_buttons = [("assets/buttons/skip_btn.png", constants.SCREEN_BOTTOM_REGION),
+                      ("assets/buttons/skip_btn_big.png", constants.SKIP_BTN_BIG_REGION_LANDSCAPE)]
+      skip_btn = locator.wait_for(skip_buttons, timeout=get_secs(2))
+      if not skip_btn:
         warning("Coulnd't find skip buttons at first search.")
-        skip_btn = pyautogui.locateOnScreen("assets/buttons/skip_btn.png", confidence=0.8, minSearchTime=get_secs(10), region=constants.SCREEN_BOTTOM_REGION)
-        skip_btn_big = pyautogui.locateOnScreen("assets/buttons/skip_btn_big.png", confidence=0.8, minSearchTime=get_secs(10), region=constants.SKIP_BTN_BIG_REGION_LANDSCAPE)
+        skip_btn = locator.wait_for(skip_buttons, timeout=get_secs(10))
       if skip_btn:
-        click(boxes=skip_btn, click=3)
-      if skip_btn_big:
-        click(boxes=skip_btn_big, click=3)
+        click(boxes=skip_btn.box, click=3)
+        sleep(3)
+        click(boxes=skip_btn.box, click=3)
+        sleep(0.5)
+        click(boxes=skip_btn.box, click=3)
       sleep(3)
+      skip_btn = locator.wait_for("assets/buttons/skip_btn.png", timeout=get_secs(5), region=constants.SCREEN_BOTTOM_REGION)
       if skip_btn:
-        click(boxes=skip_btn, click=3)
-      if skip_btn_big:
-        click(boxes=skip_btn_big, click=3)
-      sleep(0.5)
-      if skip_btn:
-        click(boxes=skip_btn, click=3)
-      if skip_btn_big:
-        click(boxes=skip_btn_big, click=3)
-      sleep(3)
-      skip_btn = pyautogui.locateOnScreen("assets/buttons/skip_btn.png", confidence=0.8, minSearchTime=get_secs(5), region=constants.SCREEN_BOTTOM_REGION)
-      click(boxes=skip_btn, click=3)
+        click(boxes=skip_btn.box, click=3)
       #since we didn't get the trophy before, if we get it we close the trophy
-      close_btn = pyautogui.locateOnScreen("assets/buttons/close_btn.png", confidence=0.8, minSearchTime=get_secs(5))
-      click(boxes=close_btn, click=3)
+      close_btn = locator.wait_for("assets/buttons/close_btn.png", timeout=get_secs(5))
+      if close_btn:
+        click(boxes=close_btn.box, click=3)
       info("Finished race skipping job.")
 
 def after_race():
@@ -392,7 +382,6 @@ def auto_buy_skill():
   sleep(0.5)
 
   if buy_skill():
-    pyautogui.locateCenterOnScreen("assets/buttons/confirm_btn.png")
     click(img="assets/buttons/confirm_btn.png", minSearch=get_secs(1), region=constants.SCREEN_BOTTOM_REGION)
     sleep(0.5)
     click(img="assets/buttons/learn_btn.png", minSearch=get_secs(1), region=constants.SCREEN_BOTTOM_REGION)
@@ -405,16 +394,31 @@ def auto_buy_skill():
     click(img="assets/buttons/back_btn.png")
 
 PREFERRED_POSITION_SET = False
+# seconds between whole screen lobby matches when nothing is found in the template regions
+FULL_FRAME_FALLBACK_INTERVAL = 2
+
+def inside_region(box, region):
+  """Whether an (x, y, w, h) box lies within an (x, y, w, h) region."""
+  left, top, right, bottom = region_to_bbox(region)
+  x, y, w, h = box
+  return left <= x and top <= y and x + w <= right and y + h <= bottom
+
 def career_lobby():
   # Program start
   global PREFERRED_POSITION_SET
   PREFERRED_POSITION_SET = False
+  last_full_frame_match = 0
+  change_detector = ChangeDetector()
+  matches = {}
+  # polls fast while the screen moves, slower the longer nothing happens
+  cpu_budget = state.CPU_BUDGET_PERCENT / 100 if state.CPU_BUDGET_PERCENT else None
+  governor = PollGovernor(cpu_budget=cpu_budget)
+  locator.governor.cpu_budget = cpu_budget
   while state.is_bot_running and not state.stop_event.is_set():
     # Debug: Log current cycle
     if DEBUG_MODE:
       log_message("\n=== New Career Lobby Cycle ===")
       # Only visualize zones periodically to avoid blocking
-      import time
       current_time = time.time()
       if not hasattr(career_lobby, 'last_zone_save'):
         career_lobby.last_zone_save = 0
@@ -422,8 +426,41 @@ def career_lobby():
         visualize_all_zones(save_to_file=True, show_window=False)
         career_lobby.last_zone_save = current_time
 
-    screen = ImageGrab.grab()
-    matches = multi_match_templates(templates, screen=screen)
+    # every probe of this cycle crops from this grab until the next click
+    screen = capture_frame()
+    # skip frames taken mid transition, and a still screen nothing was found on last time
+    change = change_detector.update(screen)
+    if change == MOVING:
+      governor.active()
+      governor.wait()
+      continue
+    # unless the full frame fallback is due, it may find what the bands missed
+    fallback_due = time.time() - last_full_frame_match >= FULL_FRAME_FALLBACK_INTERVAL
+    if change == UNCHANGED and not any(matches.values()) and not fallback_due:
+      governor.idle()
+      governor.wait()
+      continue
+
+    # only look for what can be on this screen, everything when it isn't recognized
+    wanted = constants.SCREEN_LOBBY_TEMPLATES.get(classify_screen(screen), list(constants.LOBBY_TEMPLATES))
+    lobby_templates = {name: constants.LOBBY_TEMPLATES[name] for name in wanted}
+    matches = {name: [] for name in constants.LOBBY_TEMPLATES}
+    template_regions = constants.resolve_regions(constants.LOBBY_TEMPLATE_REGIONS)
+    matches.update(multi_match_templates(lobby_templates, screen=screen, pyramid=True, regions=template_regions))
+    # something may show up outside its usual band, or on a misclassified screen,
+    # now and then look for every template on the whole screen
+    if not any(matches.values()) and fallback_due:
+      matches.update(multi_match_templates(constants.LOBBY_TEMPLATES, screen=screen, pyramid=True))
+      last_full_frame_match = time.time()
+      # a template found outside its band means LOBBY_TEMPLATE_REGIONS needs widening
+      for name, boxes in matches.items():
+        if not boxes:
+          continue
+        x, y, w, h = boxes[0]
+        box = (x + screen.left, y + screen.top, w, h)
+        if not inside_region(box, template_regions[name]):
+          warning(f"{name} found at {box}, outside its search region {template_regions[name]}.")
+    change_detector.processed()
 
     # Debug: Log what was found
     if DEBUG_MODE:
@@ -431,7 +468,7 @@ def career_lobby():
       log_message(f"Found elements: {found_items if found_items else 'None'}")
       if found_items:
         # Save screenshot of found items
-        screen_bgr = cv2.cvtColor(np.array(screen), cv2.COLOR_RGB2BGR)
+        screen_bgr = screen.bgr().copy()
         for name, boxes in matches.items():
           if boxes:
             for box in boxes[:1]:  # Just mark first match
@@ -457,7 +494,10 @@ def career_lobby():
     if not matches["tazuna"]:
       #info("Should be in career lobby.")
       print(".", end="")
+      governor.idle()
+      governor.wait()
       continue
+    governor.active()
 
     energy_level, max_energy = check_energy_level()
 
@@ -471,13 +511,15 @@ def career_lobby():
         info("Skipping infirmary because of high energy.")
         skipped_infirmary=True
 
+    # criteria always needs OCR, it's read while the other fields are checked
+    criteria_reading = submit_criteria()
     mood = check_mood()
     mood_index = constants.MOOD_LIST.index(mood)
     minimum_mood = constants.MOOD_LIST.index(state.MINIMUM_MOOD)
     minimum_mood_junior_year = constants.MOOD_LIST.index(state.MINIMUM_MOOD_JUNIOR_YEAR)
     turn = check_turn()
     year = check_current_year()
-    criteria = check_criteria()
+    criteria, _ = criteria_reading.result()
     year_parts = year.split(" ")
 
     print("\n=======================================================================================\n")
@@ -487,6 +529,15 @@ def career_lobby():
     info(f"Criteria: {criteria}")
     print("\n=======================================================================================\n")
 
+    # capture cost since the previous turn
+    grab_stats = capture_stats()
+    debug(f"Screen capture: {grab_stats['grabs']} grabs, {grab_stats['total_ms']:.1f} ms total, {grab_stats['avg_ms']:.2f} ms avg, {grab_stats['max_ms']:.2f} ms max")
+    reset_capture_stats()
+    cache_stats = ocr_cache.stats()
+    debug(f"OCR cache: {cache_stats['memory_hits']} memory hits, {cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['revalidated']} revalidated, {cache_stats['corrected']} corrected")
+    ocr_cache.reset_stats()
+    debug(f"Lobby polling: {governor.poll_rate:.1f} polls/s, interval {governor.interval:.2f}s, bot thread CPU {governor.cpu_percent():.0f}%, throttled {governor.throttled} times")
+
     # URA SCENARIO
     if year == "Finale Season" and turn == "Race Day":
       info("URA Finale")
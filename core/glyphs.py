@@ -0,0 +1,133 @@
+import cv2
+import numpy as np
+
+from utils.log import debug
+from utils.saved import saved_loader
+
+# Numeric HUD fields are drawn in the game's own fonts, their glyphs can be
+# matched directly instead of going through the OCR model.
+GLYPH_ATLAS_PATH = "glyph_atlas.npz"
+GLYPH_SIZE = (12, 16)          # (w, h) every glyph is normalized to
+MIN_GLYPH_CONFIDENCE = 0.8     # worst glyph similarity for a reading to be trusted
+MAX_SAMPLES_PER_GLYPH = 16
+
+# How each field is drawn: text darker or lighter than what's behind it, which
+# line of text holds the number and how many glyphs it can have at most
+GLYPH_FIELDS = {
+  "stat": {"text": "dark", "line": "tallest", "max_glyphs": 4},
+  "skill_pts": {"text": "dark", "line": "tallest", "max_glyphs": 4},
+  "turn": {"text": "dark", "line": "tallest", "max_glyphs": 2},
+}
+
+def binarize(gray, text="dark"):
+  """Text pixels of a grayscale crop as 255, Otsu picks the threshold."""
+  flag = cv2.THRESH_BINARY_INV if text == "dark" else cv2.THRESH_BINARY
+  _, mask = cv2.threshold(gray, 0, 255, flag | cv2.THRESH_OTSU)
+  return mask
+
+def _runs(profile, min_length=1):
+  # (start, end) of the stretches where profile is non zero
+  filled = np.concatenate([[0], (profile > 0).astype(np.int8), [0]])
+  edges = np.flatnonzero(np.diff(filled))
+  return [(start, end) for start, end in zip(edges[::2], edges[1::2]) if end - start >= min_length]
+
+def segment(gray, field):
+  """Glyph masks of the number in a field crop, left to right, by row then column projection."""
+  profile = GLYPH_FIELDS[field]
+  mask = binarize(gray, profile["text"])
+  lines = _runs(mask.sum(axis=1), min_length=max(3, gray.shape[0] // 10))
+  if not lines:
+    return []
+  if profile["line"] == "tallest":
+    top, bottom = max(lines, key=lambda line: line[1] - line[0])
+  else:
+    top, bottom = lines[-1]
+
+  line = mask[top:bottom]
+  min_width = max(1, (bottom - top) // 10)
+  glyphs = []
+  for left, right in _runs(line.sum(axis=0), min_length=min_width):
+    glyph = line[:, left:right]
+    rows = np.flatnonzero(glyph.any(axis=1))
+    glyphs.append(glyph[rows[0]:rows[-1] + 1])
+  return glyphs
+
+def glyph_vector(glyph):
+  """Glyph mask resized to GLYPH_SIZE, zero mean and unit length so a dot product is a correlation."""
+  # narrow glyphs like 1 are centered instead of stretched, their width tells them apart
+  h, w = glyph.shape
+  width = int(round(h * GLYPH_SIZE[0] / GLYPH_SIZE[1]))
+  if w < width:
+    left = (width - w) // 2
+    glyph = cv2.copyMakeBorder(glyph, 0, 0, left, width - w - left, cv2.BORDER_CONSTANT, value=0)
+  vector = cv2.resize(glyph, GLYPH_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+  vector -= vector.mean()
+  norm = np.linalg.norm(vector)
+  return vector / norm if norm else vector
+
+class GlyphAtlas:
+  """Labeled glyph samples per field, classifies by best correlation."""
+
+  def __init__(self):
+    self.fields = {}
+
+  def __len__(self):
+    return sum(len(labels) for labels, _ in self.fields.values())
+
+  def add(self, field, label, glyph):
+    labels, vectors = self.fields.get(field, ([], np.zeros((0, GLYPH_SIZE[0] * GLYPH_SIZE[1]), np.float32)))
+    if labels.count(label) >= MAX_SAMPLES_PER_GLYPH:
+      return
+    self.fields[field] = (labels + [label], np.vstack([vectors, glyph_vector(glyph)[None]]))
+
+  def classify(self, field, glyphs):
+    """[(label, similarity)] of each glyph, empty when the field has no samples."""
+    if field not in self.fields or not glyphs:
+      return []
+    labels, vectors = self.fields[field]
+    scores = np.stack([glyph_vector(glyph) for glyph in glyphs]) @ vectors.T
+    best = scores.argmax(axis=1)
+    return [(labels[i], float(scores[row, i])) for row, i in enumerate(best)]
+
+  def save(self, path=GLYPH_ATLAS_PATH):
+    arrays = {}
+    for field, (labels, vectors) in self.fields.items():
+      arrays[f"{field}_labels"] = np.array(labels)
+      arrays[f"{field}_vectors"] = vectors
+    np.savez_compressed(path, **arrays)
+
+  @classmethod
+  def load(cls, path=GLYPH_ATLAS_PATH):
+    data = np.load(path)
+    atlas = cls()
+    for key in data.files:
+      if key.endswith("_labels"):
+        field = key[:-len("_labels")]
+        atlas.fields[field] = ([str(label) for label in data[key]], data[f"{field}_vectors"])
+    return atlas
+
+# the atlas saved at GLYPH_ATLAS_PATH, None when there is none
+get_atlas = saved_loader(GLYPH_ATLAS_PATH, GlyphAtlas.load, "glyph atlas with {} glyphs")
+
+def read_glyphs(gray, field, atlas=None):
+  """(text, confidence) of the number in a field crop, ("", 0.0) when it can't be read this way."""
+  atlas = atlas or get_atlas()
+  if atlas is None:
+    return "", 0.0
+  glyphs = segment(gray, field)
+  if not glyphs or len(glyphs) > GLYPH_FIELDS[field]["max_glyphs"]:
+    return "", 0.0
+  classified = atlas.classify(field, glyphs)
+  if not classified:
+    return "", 0.0
+  text = "".join(label for label, _ in classified)
+  confidence = min(score for _, score in classified)
+  debug(f"Glyphs {field}: {text!r} ({confidence:.2f})")
+  return text, confidence
+
+def read_glyph_number(gray, field, atlas=None):
+  """(number or -1, confidence) of a digits only field."""
+  text, confidence = read_glyphs(gray, field, atlas)
+  if not text.isdigit() or confidence < MIN_GLYPH_CONFIDENCE:
+    return -1, confidence
+  return int(text), confidence
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import deque
+
+MIN_POLL_INTERVAL = 0.05   # seconds between polls while the screen is moving
+MAX_POLL_INTERVAL = 1.0    # slowest polling when nothing actionable shows up
+BACKOFF = 1.5
+CPU_WINDOW = 5             # seconds the CPU budget is measured over
+RATE_WINDOW = 10           # seconds the poll rate is averaged over
+
+class PollGovernor:
+  """Paces a polling loop.
+
+  idle() backs the interval off exponentially, active() snaps it back to the
+  fastest rate. wait() sleeps the interval, or longer if the calling thread
+  used more than `cpu_budget` (0..1 of a core, None for no limit) of the
+  current window. Every thread calling wait() has its own window, started
+  on its first call, and is only held to its own CPU time.
+  """
+
+  def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL,
+               backoff=BACKOFF, cpu_budget=None):
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.backoff = backoff
+    self.cpu_budget = cpu_budget
+    self.interval = min_interval
+    self.throttled = 0
+    self._polls = deque()
+    # (wall, thread CPU) time the calling thread's window started at
+    self._windows = threading.local()
+
+  def active(self):
+    self.interval = self.min_interval
+
+  def idle(self):
+    self.interval = min(self.interval * self.backoff, self.max_interval)
+
+  def _window(self):
+    # thread_time() only compares with readings of the same thread
+    if not hasattr(self._windows, "start"):
+      self._reset_window(time.monotonic())
+    return self._windows.start, self._windows.cpu
+
+  def _reset_window(self, now):
+    self._windows.start = now
+    self._windows.cpu = time.thread_time()
+
+  def wait(self, limit=None):
+    """Sleep before the next poll, never longer than `limit` seconds if given."""
+    window_start, window_cpu = self._window()
+    now = time.monotonic()
+    delay = self.interval
+    if self.cpu_budget:
+      used = time.thread_time() - window_cpu
+      # wall time the window has to span for that CPU time to fit the budget
+      needed = used / self.cpu_budget - (now - window_start)
+      if needed > delay:
+        delay = needed
+        self.throttled += 1
+    if limit is not None:
+      delay = min(delay, limit)
+    if delay > 0:
+      time.sleep(delay)
+
+    now = time.monotonic()
+    self._polls.append(now)
+    while self._polls[0] < now - RATE_WINDOW:
+      self._polls.popleft()
+    if now - window_start >= CPU_WINDOW:
+      self._reset_window(now)
+
+  @property
+  def poll_rate(self):
+    """Polls per second over the last RATE_WINDOW seconds."""
+    if len(self._polls) < 2:
+      return 0.0
+    span = self._polls[-1] - self._polls[0]
+    return (len(self._polls) - 1) / span if span > 0 else 0.0
+
+  def cpu_percent(self):
+    """CPU use of the calling thread in its current window, in percent of a core."""
+    window_start, window_cpu = self._window()
+    elapsed = time.monotonic() - window_start
+    if elapsed <= 0:
+      return 0.0
+    return (time.thread_time() - window_cpu) / elapsed * 100
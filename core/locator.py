@@ -0,0 +1,97 @@
+import cv2
+import time
+
+from utils.screenshot import grab_frame, region_to_bbox, union_bbox, invalidate_frame, get_frame_source
+from core.templates import get_template
+from core.governor import PollGovernor
+
+# seconds between two looks at the screen while waiting, backing off to the max
+DEFAULT_POLL_INTERVAL = 0.1
+MAX_WAIT_POLL_INTERVAL = 0.5
+
+class Match:
+  """Where a template was found, box is the screen (x, y, w, h)."""
+
+  def __init__(self, template, box, score):
+    self.template = template
+    self.box = box
+    self.score = score
+
+  @property
+  def center(self):
+    x, y, w, h = self.box
+    return (x + w // 2, y + h // 2)
+
+  def __repr__(self):
+    return f"Match({self.template.name}, box={self.box}, score={self.score:.3f})"
+
+class Locator:
+  """Finds templates on screen through the frame source and the template registry.
+
+  Waits poll through a PollGovernor, fast at first and slower the longer
+  nothing shows up. Targets are asset paths or Template handles, optionally paired with their own
+  (x, y, w, h) region as (template, region). Every poll grabs the screen once,
+  covering all the targets, and checks them in the order they were given.
+  """
+
+  def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL, max_poll_interval=MAX_WAIT_POLL_INTERVAL):
+    self.governor = PollGovernor(min_interval=poll_interval, max_interval=max_poll_interval)
+    self.polls = 0
+
+  def _targets(self, any_of, region):
+    if not isinstance(any_of, (list, tuple)) or (len(any_of) == 2 and _is_region(any_of[1])):
+      any_of = [any_of]
+    targets = []
+    for target in any_of:
+      template, target_region = target if isinstance(target, tuple) else (target, region)
+      bbox = region_to_bbox(target_region) if target_region else None
+      targets.append((get_template(template), bbox))
+    return targets
+
+  def _poll(self, targets, confidence):
+    self.polls += 1
+    bboxes = [bbox for _, bbox in targets]
+    frame = grab_frame(None if None in bboxes else union_bbox(bboxes))
+    for template, bbox in targets:
+      search = frame.crop(bbox) if bbox else frame
+      if search is None or search.width < template.width or search.height < template.height:
+        continue
+      result = cv2.matchTemplate(search.bgr(), template.bgr, cv2.TM_CCOEFF_NORMED)
+      _, max_val, _, max_loc = cv2.minMaxLoc(result)
+      if max_val >= confidence:
+        box = (max_loc[0] + search.left, max_loc[1] + search.top, template.width, template.height)
+        return Match(template, box, max_val)
+    return None
+
+  def _wait(self, targets, confidence, timeout, until_gone):
+    deadline = time.time() + timeout
+    self.governor.active()
+    while True:
+      match = self._poll(targets, confidence)
+      if (match is None) == until_gone:
+        return match, True
+      if time.time() >= deadline or not get_frame_source().live:
+        return match, False
+      # the cycle frame won't change, look at the live screen from now on
+      invalidate_frame()
+      self.governor.wait(limit=max(0, deadline - time.time()))
+      self.governor.idle()
+
+  def find(self, template, region=None, confidence=0.8):
+    """Best match of a template in one look at the screen, or None."""
+    return self._poll(self._targets(template, region), confidence)
+
+  def wait_for(self, any_of, timeout=0, region=None, confidence=0.8):
+    """First of the targets to show up within timeout seconds, or None."""
+    match, _ = self._wait(self._targets(any_of, region), confidence, timeout, until_gone=False)
+    return match
+
+  def wait_gone(self, template, timeout=0, region=None, confidence=0.8):
+    """True once none of the targets is on screen, False if one still is at the timeout."""
+    _, gone = self._wait(self._targets(template, region), confidence, timeout, until_gone=True)
+    return gone
+
+def _is_region(value):
+  return value is None or (isinstance(value, tuple) and len(value) == 4)
+
+locator = Locator()
@@ -1,24 +1,308 @@
-import easyocr
-from PIL import Image
+import cv2
+import hashlib
 import numpy as np
+import os
 import re
-import torch
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
 
-# Use GPU if available
-use_gpu = torch.cuda.is_available()
-reader = easyocr.Reader(["en"], gpu=use_gpu)
+from utils.log import info, warning, debug
 
-def extract_text(pil_img: Image.Image) -> str:
-  img_np = np.array(pil_img)
-  result = reader.readtext(img_np)
-  texts = [text[1] for text in result]
-  return " ".join(texts)
+# easyocr pulls in torch, the reader is only built when something needs it
+_reader = None
+_reader_lock = threading.Lock()
+reader_ready = threading.Event()
+# threads torch runs inference on, 0 leaves torch's default
+_torch_threads = 0
 
-def extract_number(pil_img: Image.Image) -> int:
-  img_np = np.array(pil_img)
-  result = reader.readtext(img_np, allowlist="0123456789")
-  texts = [text[1] for text in result]
-  joined_text = "".join(texts)
+def build_reader(quantize=True):
+  """New easyocr Reader, on the GPU when there is one.
+
+  On CPU easyocr runs its networks dynamically quantized to int8 unless
+  `quantize` is off, bench_ocr.py compares the two.
+  """
+  import easyocr
+  import torch
+
+  start = time.time()
+  if _torch_threads:
+    torch.set_num_threads(_torch_threads)
+  # Use GPU if available
+  use_gpu = torch.cuda.is_available()
+  reader = easyocr.Reader(["en"], gpu=use_gpu, quantize=quantize)
+  # one pass through the detector and the recognizer so the first real call isn't the slow one
+  blank = np.full((64, 256), 255, np.uint8)
+  reader.readtext(blank)
+  reader.recognize(blank)
+  info(f"OCR ready in {time.time() - start:.1f}s ({'GPU' if use_gpu else 'int8 CPU' if quantize else 'CPU'}).")
+  return reader
+
+def get_reader():
+  """The easyocr Reader, built and warmed on first use. Waits for a warm-up in progress."""
+  global _reader
+  if _reader is None:
+    with _reader_lock:
+      if _reader is None:
+        _reader = build_reader()
+        reader_ready.set()
+  return _reader
+
+# OCR can run in worker processes, each with its own reader, so inference
+# doesn't hold the GIL the bot thread shares with the config server.
+# 0 workers reads on the calling thread.
+_ocr_workers = 0
+_ocr_executor = None
+_ocr_executor_lock = threading.Lock()
+
+def _init_worker(torch_threads):
+  global _torch_threads
+  _torch_threads = torch_threads
+  get_reader()
+
+def _worker_ready():
+  return os.getpid()
+
+def set_ocr_workers(workers, torch_threads=0):
+  """Read in `workers` processes with `torch_threads` each, 0 workers reads in process."""
+  global _ocr_workers, _torch_threads, _ocr_executor
+  workers = max(0, int(workers))
+  torch_threads = max(0, int(torch_threads))
+  with _ocr_executor_lock:
+    if (workers, torch_threads) == (_ocr_workers, _torch_threads):
+      return
+    if _ocr_executor is not None:
+      _ocr_executor.shutdown(wait=False, cancel_futures=True)
+      _ocr_executor = None
+    _ocr_workers = workers
+    _torch_threads = torch_threads
+  if _reader is not None and torch_threads:
+    import torch
+    torch.set_num_threads(torch_threads)
+
+def get_ocr_executor():
+  """Shared OCR worker pool, None when reading in process."""
+  global _ocr_executor
+  with _ocr_executor_lock:
+    if _ocr_executor is None and _ocr_workers > 0:
+      _ocr_executor = ProcessPoolExecutor(max_workers=_ocr_workers, initializer=_init_worker,
+                                          initargs=(_torch_threads,))
+    return _ocr_executor
+
+def start_warm_up():
+  """Build the reader, or start the workers, in the background so OCR is ready by the first call."""
+  executor = get_ocr_executor()
+  if executor is not None:
+    debug(f"Starting {_ocr_workers} OCR worker processes.")
+    for _ in range(_ocr_workers):
+      executor.submit(_worker_ready)
+    return
+  if reader_ready.is_set():
+    return
+  debug("Warming up OCR in the background.")
+  threading.Thread(target=get_reader, name="ocr-warm-up", daemon=True).start()
+
+# The same crops come back turn after turn, their results are cached by a digest
+# of the pixels with the two lowest bits dropped. An exact digest rather than a
+# loose perceptual hash, one changed digit only moves a handful of pixels.
+OCR_CACHE_PATH = "ocr_cache.sqlite"
+MAX_MEMORY_ENTRIES = 512
+MAX_DISK_ENTRIES = 20000
+EVICT_EVERY = 100                # puts between disk evictions
+MIN_CACHED_CONFIDENCE = 0.5      # less sure readings aren't kept
+REVALIDATE_AFTER_HITS = 50       # a cached crop is read again after this many hits
+REVALIDATE_SECONDS = 24 * 3600   # or this long after it was last read
+
+def crop_key(kind, img):
+  """Cache key of a crop read as `kind` (a field or how it's read)."""
+  img = np.ascontiguousarray(img)
+  digest = hashlib.blake2b((img >> 2).tobytes(), digest_size=16)
+  digest.update(str(img.shape).encode())
+  return f"{kind}:{digest.hexdigest()}"
+
+class OcrCache:
+  """(text, confidence) of read crops, in an LRU in memory backed by a sqlite file.
+
+  get() gives None on a miss, and for an entry due to be checked, so it gets
+  read again; put() stores the new reading, or drops the entry when the new
+  reading isn't sure. `path` None keeps the cache in memory only.
+  """
+
+  def __init__(self, path=OCR_CACHE_PATH, max_memory=MAX_MEMORY_ENTRIES, max_disk=MAX_DISK_ENTRIES):
+    self.path = path
+    self.max_memory = max_memory
+    self.max_disk = max_disk
+    self._memory = OrderedDict()   # key: [text, confidence, verified_at, hits since]
+    self._due = {}                 # key: cached text of entries being read again
+    self._db = None
+    self._puts = 0
+    self._lock = threading.Lock()
+    self.reset_stats()
+
+  def reset_stats(self):
+    self.memory_hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.revalidated = 0
+    self.corrected = 0
+
+  def stats(self):
+    lookups = self.memory_hits + self.disk_hits + self.misses + self.revalidated
+    return {
+      "memory_hits": self.memory_hits,
+      "disk_hits": self.disk_hits,
+      "misses": self.misses,
+      "revalidated": self.revalidated,
+      "corrected": self.corrected,
+      "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+      "entries": len(self._memory),
+    }
+
+  def _connect(self):
+    if self._db is None and self.path:
+      try:
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                         "(key TEXT PRIMARY KEY, text TEXT, confidence REAL, verified_at REAL, used_at REAL)")
+      except sqlite3.Error as e:
+        warning(f"OCR cache file {self.path} can't be used, caching in memory only: {e}")
+        self.path = None
+        self._db = None
+    return self._db
+
+  def _remember(self, key, entry):
+    self._memory[key] = entry
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.max_memory:
+      self._memory.popitem(last=False)
+
+  def _load(self, key):
+    db = self._connect()
+    if db is None:
+      return None
+    row = db.execute("SELECT text, confidence, verified_at FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+      return None
+    db.execute("UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key))
+    db.commit()
+    return [row[0], row[1], row[2], 0]
+
+  def _store(self, key, text, confidence, now):
+    db = self._connect()
+    if db is None:
+      return
+    db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (key, text, confidence, now, now))
+    self._puts += 1
+    if self._puts % EVICT_EVERY == 0:
+      # least recently used rows past the size limit
+      db.execute("DELETE FROM results WHERE key IN "
+                 "(SELECT key FROM results ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_disk,))
+    db.commit()
+
+  def _forget(self, key):
+    self._memory.pop(key, None)
+    db = self._connect()
+    if db is not None:
+      db.execute("DELETE FROM results WHERE key = ?", (key,))
+      db.commit()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._memory.get(key)
+      if entry is not None:
+        self._memory.move_to_end(key)
+        tier = "memory"
+      else:
+        entry = self._load(key)
+        if entry is None:
+          self.misses += 1
+          return None
+        self._remember(key, entry)
+        tier = "disk"
+
+      text, confidence, verified_at, hits = entry
+      if hits >= REVALIDATE_AFTER_HITS or time.time() - verified_at > REVALIDATE_SECONDS:
+        self._due[key] = text
+        self.revalidated += 1
+        return None
+      entry[3] += 1
+      if tier == "memory":
+        self.memory_hits += 1
+      else:
+        self.disk_hits += 1
+      return text, confidence
+
+  def put(self, key, text, confidence):
+    with self._lock:
+      previous = self._due.pop(key, None)
+      if previous is not None and previous != text:
+        self.corrected += 1
+        debug(f"OCR cache entry {key} read {previous!r} before, now {text!r}.")
+      if confidence < MIN_CACHED_CONFIDENCE:
+        self._forget(key)
+        return
+      now = time.time()
+      self._remember(key, [text, confidence, now, 0])
+      self._store(key, text, confidence, now)
+
+ocr_cache = OcrCache()
+
+def _run(read, *args):
+  # future of read(*args) run on the calling thread, or on the pool when there is one
+  executor = get_ocr_executor()
+  if executor is not None:
+    return executor.submit(read, *args)
+  future = Future()
+  try:
+    future.set_result(read(*args))
+  except Exception as e:
+    future.set_exception(e)
+  return future
+
+def _done(value):
+  future = Future()
+  future.set_result(value)
+  return future
+
+def submit_read(kind, img, read, *args):
+  """Future of a crop's (text, confidence), from the cache or from read(img, *args) which is then cached.
+
+  `read` runs in a worker process when there are workers, it has to be a module level function.
+  """
+  key = crop_key(kind, img)
+  hit = ocr_cache.get(key)
+  if hit is not None:
+    return _done(hit)
+  future = _run(read, img, *args)
+
+  def cache_result(done):
+    if not done.cancelled() and done.exception() is None:
+      ocr_cache.put(key, *done.result())
+  future.add_done_callback(cache_result)
+  return future
+
+def _read_text(img, allowlist=None, separator=" ", reader=None):
+  result = (reader or get_reader()).readtext(img, allowlist=allowlist)
+  text = separator.join(r[1] for r in result)
+  confidence = min((float(r[2]) for r in result), default=0.0)
+  return text, confidence
+
+def _read_digits(img):
+  return _read_text(img, "0123456789", "")
+
+def submit_text(img: np.ndarray) -> Future:
+  """Future of (text, confidence) of a crop read with detection."""
+  return submit_read("text", np.asarray(img), _read_text)
+
+def extract_text(img: np.ndarray) -> str:
+  text, _ = submit_text(img).result()
+  return text
+
+def extract_number(img: np.ndarray) -> int:
+  joined_text, _ = submit_read("number", np.asarray(img), _read_digits).result()
 
   digits = re.sub(r"[^\d]", "", joined_text)
 
@@ -26,3 +310,121 @@ def extract_number(pil_img: Image.Image) -> int:
     return int(digits)
   
   return -1
+
+# rows between the crops stacked for read_numbers, keeps the recognizer from joining them
+STACK_GAP = 8
+
+def stack_crops(images):
+  """Gray crops stacked top to bottom on one canvas, with their [x_min, x_max, y_min, y_max] boxes."""
+  width = max(img.shape[1] for img in images)
+  rows, boxes, y = [], [], 0
+  for img in images:
+    h, w = img.shape[:2]
+    # pad with the crop's own edge so the gap doesn't read as a glyph
+    rows.append(cv2.copyMakeBorder(img, 0, STACK_GAP, 0, width - w, cv2.BORDER_REPLICATE))
+    boxes.append([0, w, y, y + h])
+    y += h + STACK_GAP
+  return np.vstack(rows), boxes
+
+def _recognize_numbers(images, allowlist):
+  # [(text, confidence)] of each crop, stacked and read in one recognizer call
+  canvas, boxes = stack_crops(images)
+  result = get_reader().recognize(canvas, horizontal_list=boxes, free_list=[], allowlist=allowlist,
+                                  batch_size=len(boxes), detail=1)
+  readings = [("", 0.0)] * len(images)
+  for box, text, confidence in result:
+    # easyocr hands results back sorted by position, map them to their crop by y
+    top = min(point[1] for point in box)
+    i = next(i for i, (_, _, y_min, y_max) in enumerate(boxes) if y_min <= top < y_max)
+    readings[i] = (text, float(confidence))
+  return readings
+
+def _to_numbers(texts):
+  numbers = []
+  for text, confidence in texts:
+    digits = re.sub(r"[^\d]", "", text)
+    numbers.append((int(digits), confidence) if digits else (-1, confidence))
+  return numbers
+
+def submit_numbers(images, allowlist="0123456789") -> Future:
+  """Future of read_numbers' result."""
+  images = [np.asarray(img) for img in images]
+  keys = [crop_key(f"numbers:{allowlist}", img) for img in images]
+  texts = [ocr_cache.get(key) for key in keys]
+  unread = [i for i, text in enumerate(texts) if text is None]
+  if not unread:
+    return _done(_to_numbers(texts))
+
+  numbers = Future()
+  def collect(done):
+    if done.cancelled():
+      numbers.cancel()
+    elif done.exception() is not None:
+      numbers.set_exception(done.exception())
+    else:
+      for i, reading in zip(unread, done.result()):
+        texts[i] = reading
+        ocr_cache.put(keys[i], *reading)
+      numbers.set_result(_to_numbers(texts))
+  _run(_recognize_numbers, [images[i] for i in unread], allowlist).add_done_callback(collect)
+  return numbers
+
+def read_numbers(images, allowlist="0123456789"):
+  """One number per gray crop, as [(number or -1, confidence)] in the same order.
+
+  The crops are known text boxes, so detection is skipped: the ones not in the
+  cache are stacked and go through the recognizer in a single call, batched as one.
+  """
+  return submit_numbers(images, allowlist).result()
+
+# Fixed position fields are tight boxes already, the recognizer can read them
+# without the detector. Per field: the height the crop is scaled to before
+# padding, the characters it can hold and the confidence below which the
+# field is read again with detection.
+FIELD_PADDING = 8
+FIELDS = {
+  "mood": {"height": 48, "allowlist": None, "min_confidence": 0.5},
+  "turn": {"height": 64, "allowlist": None, "min_confidence": 0.5},
+  "year": {"height": 48, "allowlist": None, "min_confidence": 0.5},
+  "criteria": {"height": 48, "allowlist": None, "min_confidence": 0.4},
+  "skill_pts": {"height": 48, "allowlist": "0123456789", "min_confidence": 0.5},
+  "failure": {"height": 48, "allowlist": "Failure0123456789% ", "min_confidence": 0.5},
+}
+
+def field_canvas(img, height):
+  """Crop scaled to `height` px, keeping its aspect, with a border of its own edge pixels."""
+  scale = height / img.shape[0]
+  interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+  img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=interpolation)
+  return cv2.copyMakeBorder(img, FIELD_PADDING, FIELD_PADDING, FIELD_PADDING, FIELD_PADDING, cv2.BORDER_REPLICATE)
+
+def recognize_field(img, field, reader=None):
+  """read_field without the cache, on `reader` if given."""
+  profile = FIELDS[field]
+  reader = reader or get_reader()
+  canvas = field_canvas(img, profile["height"])
+  result = reader.recognize(canvas, allowlist=profile["allowlist"], detail=1)
+  text = " ".join(r[1] for r in result).strip()
+  confidence = min((float(r[2]) for r in result), default=0.0)
+  if text and confidence >= profile["min_confidence"]:
+    return text, confidence
+
+  debug(f"Unsure {field} reading {text!r} ({confidence:.2f}), reading it again with detection.")
+  return _read_text(img, profile["allowlist"], reader=reader)
+
+def submit_field(img: np.ndarray, field: str) -> Future:
+  """Future of read_field's result, so other fields can be checked while it's read."""
+  return submit_read(field, np.asarray(img), recognize_field, field)
+
+def read_field(img: np.ndarray, field: str):
+  """(text, confidence) of a fixed field crop, see FIELDS.
+
+  The whole crop goes to the recognizer as one text box; when it isn't sure
+  the crop is read again with detection like extract_text does.
+  """
+  return submit_field(img, field).result()
+
+def read_field_number(img: np.ndarray, field: str) -> int:
+  text, _ = read_field(img, field)
+  digits = re.sub(r"[^\d]", "", text)
+  return int(digits) if digits else -1
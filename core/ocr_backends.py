@@ -0,0 +1,239 @@
+import json
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+from utils.log import info, warning, debug
+from core.ocr import FIELDS, submit_field, submit_text, submit_numbers
+from core.glyphs import GLYPH_FIELDS, MIN_GLYPH_CONFIDENCE, read_glyphs
+from core.vocab import VOCABULARIES, read_label
+
+# Every field the bot reads text from. Fixed fields are one line in a known box
+# (see core.ocr.FIELDS), stats are read in one batch, the rest is free text
+# that needs detection.
+TEXT_FIELDS = ("skill_name", "race_info", "status_effects")
+ROUTED_FIELDS = ("stat",) + tuple(FIELDS) + TEXT_FIELDS
+
+class OcrBackend:
+  """Reads the text of a field crop as (text, confidence).
+
+  accepts() tells whether a reading is sure enough to stop at, otherwise the
+  next backend of the field's route reads the crop again.
+  """
+  name = ""
+  min_confidence = 0.5
+
+  def available(self):
+    return True
+
+  def supports(self, field):
+    return True
+
+  def read(self, img, field):
+    raise NotImplementedError
+
+  def read_many(self, images, field):
+    return [self.read(img, field) for img in images]
+
+  def accepts(self, reading, field):
+    text, confidence = reading
+    return bool(text) and confidence >= self.min_confidence
+
+class EasyOcrBackend(OcrBackend):
+  """The easyocr reader, cached and on the worker pool if there is one. Reads everything."""
+  name = "easyocr"
+
+  def submit(self, img, field):
+    """Future of the reading, see core.ocr.submit_field."""
+    if field in TEXT_FIELDS:
+      return submit_text(img)
+    if field == "stat":
+      number = Future()
+      def collect(done):
+        if done.cancelled():
+          number.cancel()
+        elif done.exception() is not None:
+          number.set_exception(done.exception())
+        else:
+          number.set_result(_number_text(done.result()[0]))
+      submit_numbers([img]).add_done_callback(collect)
+      return number
+    return submit_field(img, field)
+
+  def read(self, img, field):
+    return self.submit(img, field).result()
+
+  def read_many(self, images, field):
+    if field == "stat":
+      return [_number_text(reading) for reading in submit_numbers(images).result()]
+    futures = [self.submit(img, field) for img in images]
+    return [future.result() for future in futures]
+
+  def accepts(self, reading, field):
+    min_confidence = FIELDS[field]["min_confidence"] if field in FIELDS else self.min_confidence
+    return bool(reading[0]) and reading[1] >= min_confidence
+
+def _number_text(reading):
+  number, confidence = reading
+  return (str(number) if number != -1 else "", confidence)
+
+class TesseractBackend(OcrBackend):
+  """Tesseract through one tesserocr API handle kept open, pytesseract when tesserocr isn't installed."""
+  name = "tesseract"
+  min_confidence = 0.6
+
+  def __init__(self):
+    self._api = None
+    self._pytesseract = None
+    self._available = None
+    self._lock = threading.Lock()
+
+  def available(self):
+    if self._available is None:
+      try:
+        import tesserocr
+        self._api = tesserocr.PyTessBaseAPI(lang="eng")
+      except Exception:
+        try:
+          import pytesseract
+          pytesseract.get_tesseract_version()
+          self._pytesseract = pytesseract
+        except Exception as e:
+          debug(f"Tesseract isn't available: {e}")
+      self._available = self._api is not None or self._pytesseract is not None
+    return self._available
+
+  def _settings(self, field):
+    # page segmentation: 6 is a block of text, 7 a single line
+    psm = 6 if field in TEXT_FIELDS else 7
+    allowlist = "0123456789" if field == "stat" else FIELDS.get(field, {}).get("allowlist")
+    return psm, (allowlist or "").replace(" ", "")
+
+  def read(self, img, field):
+    if not self.available():
+      return "", 0.0
+    psm, allowlist = self._settings(field)
+    if self._api is not None:
+      from PIL import Image
+      with self._lock:
+        self._api.SetPageSegMode(psm)
+        self._api.SetVariable("tessedit_char_whitelist", allowlist)
+        self._api.SetImage(Image.fromarray(np.ascontiguousarray(img)))
+        text = self._api.GetUTF8Text()
+        confidence = self._api.MeanTextConf() / 100
+      return " ".join(text.split()), confidence
+
+    config = f"--psm {psm}" + (f" -c tessedit_char_whitelist={allowlist}" if allowlist else "")
+    data = self._pytesseract.image_to_data(img, config=config, output_type=self._pytesseract.Output.DICT)
+    words = [(word, float(conf)) for word, conf in zip(data["text"], data["conf"]) if word.strip() and float(conf) >= 0]
+    text = " ".join(word for word, _ in words)
+    confidence = min((conf for _, conf in words), default=0.0) / 100
+    return text, confidence
+
+class GlyphBackend(OcrBackend):
+  """The game font's digits, see core.glyphs. Numbers only."""
+  name = "glyph"
+  min_confidence = MIN_GLYPH_CONFIDENCE
+
+  def supports(self, field):
+    return field in GLYPH_FIELDS
+
+  def read(self, img, field):
+    return read_glyphs(img, field)
+
+  def accepts(self, reading, field):
+    text, confidence = reading
+    return text.isdigit() and confidence >= self.min_confidence
+
+class VocabBackend(OcrBackend):
+  """Nearest saved rendering of a closed vocabulary field, see core.vocab."""
+  name = "vocab"
+  min_confidence = 0.0
+
+  def supports(self, field):
+    return field in VOCABULARIES
+
+  def read(self, img, field):
+    label, distance = read_label(img, field)
+    if label is None:
+      return "", 0.0
+    return label.value, 1 - distance
+
+BACKENDS = {backend.name: backend for backend in (VocabBackend(), GlyphBackend(), TesseractBackend(), EasyOcrBackend())}
+# easyocr reads anything, it ends every route
+FALLBACK_BACKEND = "easyocr"
+
+# Which backends read a field, in order, until bench_ocr.py --route measures better ones
+OCR_ROUTES_PATH = "ocr_routes.json"
+DEFAULT_ROUTES = {
+  "stat": ["glyph", "easyocr"],
+  "skill_pts": ["glyph", "easyocr"],
+  "failure": ["easyocr"],
+  "turn": ["vocab", "glyph", "easyocr"],
+  "mood": ["vocab", "easyocr"],
+  "year": ["vocab", "easyocr"],
+  "criteria": ["easyocr"],
+  "skill_name": ["easyocr"],
+  "race_info": ["easyocr"],
+  "status_effects": ["easyocr"],
+}
+
+_routes = None
+
+def get_routes():
+  """DEFAULT_ROUTES with the routes saved at OCR_ROUTES_PATH on top, loaded on first use."""
+  global _routes
+  if _routes is None:
+    _routes = dict(DEFAULT_ROUTES)
+    if Path(OCR_ROUTES_PATH).exists():
+      with open(OCR_ROUTES_PATH, "r", encoding="utf-8") as file:
+        _routes.update(json.load(file)["routes"])
+      info(f"Loaded OCR routes from {OCR_ROUTES_PATH}.")
+  return _routes
+
+def route(field):
+  """The available backends that read `field`, in order, always ending with the fallback."""
+  names = list(get_routes().get(field, []))
+  if FALLBACK_BACKEND in names:
+    names.remove(FALLBACK_BACKEND)
+  backends = []
+  for name in names + [FALLBACK_BACKEND]:
+    backend = BACKENDS.get(name)
+    if backend is None:
+      warning(f"Unknown OCR backend {name} in the {field} route.")
+    elif backend.supports(field) and backend.available():
+      backends.append(backend)
+  return backends
+
+def read_routed(img, field):
+  """(text, confidence) of a field crop from the first backend of its route that's sure of it."""
+  return read_routed_many([img], field)[0]
+
+def read_routed_many(images, field):
+  """read_routed of every crop, each backend gets the crops the ones before it weren't sure of at once."""
+  readings = [("", 0.0)] * len(images)
+  unsure = list(range(len(images)))
+  for backend in route(field):
+    if not unsure:
+      break
+    results = backend.read_many([images[i] for i in unsure], field)
+    still_unsure = []
+    for i, reading in zip(unsure, results):
+      readings[i] = reading
+      if backend.accepts(reading, field):
+        debug(f"{field} read by {backend.name}: {reading[0]!r} ({reading[1]:.2f})")
+      else:
+        still_unsure.append(i)
+    unsure = still_unsure
+  return readings
+
+def submit_routed(img, field):
+  """Future of read_routed's result. Only a route starting with easyocr is read in the background."""
+  backend = route(field)[0]
+  if isinstance(backend, EasyOcrBackend):
+    return backend.submit(img, field)
+  future = Future()
+  future.set_result(read_routed(img, field))
+  return future
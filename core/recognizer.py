@@ -1,28 +1,31 @@
 import cv2
 import numpy as np
-from PIL import ImageGrab, ImageStat
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from utils.log import info, warning, error, debug
-from utils.screenshot import capture_region
+from utils.screenshot import grab_frame, region_to_bbox
+from core.templates import get_template, COARSE_TRIM
 from utils.debug_mode import (
     DEBUG_MODE, show_debug_info, draw_search_zone,
     log_search_attempt, wait_for_step
 )
-from pathlib import Path
 
-def match_template(template_path, region=None, threshold=0.85):
+def match_template(template_path, region=None, threshold=0.85, pyramid=False):
+  # Asset path or Template handle, decoded once by the template registry
+  template = get_template(template_path)
+
   # Debug: Show what we're searching for
   if DEBUG_MODE:
     from utils.debug_mode import log_message, save_debug_screenshot
-    log_message(f"match_template called: {template_path}, region={region}, threshold={threshold}")
-    show_debug_info(template_path=template_path, region=region, threshold=threshold)
+    log_message(f"match_template called: {template.path}, region={region}, threshold={threshold}")
+    show_debug_info(template_path=template.path, region=region, threshold=threshold)
 
-  # Get screenshot
-  if region:
-    screen = np.array(ImageGrab.grab(bbox=region))  # (left, top, right, bottom)
-  else:
-    screen = np.array(ImageGrab.grab())
-  screen_bgr = cv2.cvtColor(screen, cv2.COLOR_RGB2BGR)
+  # Get screenshot, cropped from the cycle frame when there is one
+  screen = grab_frame(region)  # (left, top, right, bottom)
+  screen_bgr = screen.bgr()
 
   # Debug: Save search region to file instead of blocking display
   if DEBUG_MODE:
@@ -30,26 +33,17 @@ def match_template(template_path, region=None, threshold=0.85):
     debug_image = screen_bgr.copy()
     if region:
       cv2.rectangle(debug_image, (0, 0), (debug_image.shape[1]-1, debug_image.shape[0]-1), (0, 255, 0), 3)
-      cv2.putText(debug_image, f"Search: {template_path}", (10, 30),
+      cv2.putText(debug_image, f"Search: {template.path}", (10, 30),
                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-    save_debug_screenshot(debug_image, f"search_{Path(template_path).stem}")
-
-  # Load template
-  template = cv2.imread(template_path, cv2.IMREAD_COLOR)  # safe default
-  if template.shape[2] == 4:
-    template = cv2.cvtColor(template, cv2.COLOR_BGRA2BGR)
-  result = cv2.matchTemplate(screen_bgr, template, cv2.TM_CCOEFF_NORMED)
-  loc = np.where(result >= threshold)
+    save_debug_screenshot(debug_image, f"search_{template.name}")
 
-  h, w = template.shape[:2]
-  boxes = [(x, y, w, h) for (x, y) in zip(*loc[::-1])]
-
-  filtered_boxes = deduplicate_boxes(boxes)
+  matches = match_in_frame(screen, template, threshold, pyramid)
+  filtered_boxes = [box for box, _ in matches]
 
   # Debug: Log and save matches found
   if DEBUG_MODE:
     from utils.debug_mode import log_message, save_debug_screenshot
-    log_message(f"Found {len(filtered_boxes)} matches (before dedup: {len(boxes)})")
+    log_message(f"Found {len(filtered_boxes)} matches, scores: {[round(score, 3) for _, score in matches]}")
 
     if len(filtered_boxes) > 0:
       # Draw matches on debug image and save
@@ -57,10 +51,10 @@ def match_template(template_path, region=None, threshold=0.85):
       for x, y, w, h in filtered_boxes:
         cv2.rectangle(result_image, (x, y), (x+w, y+h), (0, 255, 0), 2)
         cv2.putText(result_image, "MATCH", (x, y-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-      save_debug_screenshot(result_image, f"found_{Path(template_path).stem}")
+      save_debug_screenshot(result_image, f"found_{template.name}")
 
     # Log the search attempt
-    log_search_attempt(f"match_template: {template_path}", region, len(filtered_boxes) > 0,
+    log_search_attempt(f"match_template: {template.path}", region, len(filtered_boxes) > 0,
                       f"Found {len(filtered_boxes)} matches")
 
     # Wait for user to continue in step-by-step mode
@@ -68,14 +62,61 @@ def match_template(template_path, region=None, threshold=0.85):
 
   return filtered_boxes
 
-def multi_match_templates(templates, screen=None, threshold=0.85):
+def match_in_frame(frame, template, threshold, pyramid=False):
+  """[((x, y, w, h), score)] of a Template in a Frame, boxes relative to the frame."""
+  if pyramid:
+    return match_pyramid(frame, template, threshold)
+  result = cv2.matchTemplate(frame.bgr(), template.bgr, cv2.TM_CCOEFF_NORMED)
+  return find_peaks(result, (template.height, template.width), threshold)
+
+# matchTemplate releases the GIL, so independent searches can run side by side
+MAX_MATCH_WORKERS = os.cpu_count() or 1
+_match_workers = MAX_MATCH_WORKERS
+_match_executor = None
+_match_executor_lock = threading.Lock()
+
+def set_match_workers(workers):
+  """Resize the matching pool, 1 runs every search on the calling thread."""
+  global _match_workers, _match_executor
+  with _match_executor_lock:
+    if _match_executor is not None:
+      _match_executor.shutdown(wait=True)
+      _match_executor = None
+    _match_workers = max(1, int(workers))
+
+def get_match_executor():
+  """Shared matching pool, None when matching single threaded."""
+  global _match_executor
+  with _match_executor_lock:
+    if _match_executor is None and _match_workers > 1:
+      _match_executor = ThreadPoolExecutor(max_workers=_match_workers, thread_name_prefix="match")
+    return _match_executor
+
+def run_parallel(jobs):
+  """Run a {name: callable} dict of jobs, results come back in the jobs' order."""
+  executor = get_match_executor()
+  # debug mode draws and logs from the jobs, keep it sequential and readable
+  if executor is None or len(jobs) < 2 or DEBUG_MODE:
+    return {name: job() for name, job in jobs.items()}
+  futures = {name: executor.submit(job) for name, job in jobs.items()}
+  return {name: future.result() for name, future in futures.items()}
+
+def multi_match_templates(templates, screen=None, threshold=0.85, pyramid=False, regions=None):
+  """Match every template of a {name: template} dict on one frame.
+
+  With pyramid=True templates are located coarse to fine (see match_pyramid),
+  the frame's pyramid is built once and shared by all of them.
+  `regions` optionally maps template names to the (x, y, w, h) screen region
+  they are searched in instead of the whole frame. Boxes are always in frame
+  coordinates.
+  """
   if DEBUG_MODE:
     debug(f"Starting multi-template match for {len(templates)} templates")
     show_debug_info(threshold=threshold)
 
   if screen is None:
-    screen = ImageGrab.grab()
-  screen_bgr = cv2.cvtColor(np.array(screen), cv2.COLOR_RGB2BGR)
+    screen = grab_frame()
+  screen_bgr = screen.bgr()
 
   # Debug: Log multi-search start
   if DEBUG_MODE:
@@ -85,24 +126,43 @@ def multi_match_templates(templates, screen=None, threshold=0.85):
                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
     save_debug_screenshot(debug_image, "multi_search_start")
 
-  results = {}
+  results = {name: [] for name in templates}
+  region_frames = {}
+  jobs = {}
+  offsets = {}
   for name, path in templates.items():
     if DEBUG_MODE:
       debug(f"Searching for template: {name} -> {path}")
 
-    template = cv2.imread(path, cv2.IMREAD_COLOR)
-    if template is None:
-      results[name] = []
+    try:
+      template = get_template(path)
+    except FileNotFoundError:
       if DEBUG_MODE:
         warning(f"Template not found: {path}")
       continue
-    if template.shape[2] == 4:
-      template = cv2.cvtColor(template, cv2.COLOR_BGRA2BGR)
 
-    result = cv2.matchTemplate(screen_bgr, template, cv2.TM_CCOEFF_NORMED)
-    loc = np.where(result >= threshold)
-    h, w = template.shape[:2]
-    boxes = [(x, y, w, h) for (x, y) in zip(*loc[::-1])]
+    search = screen
+    region = regions.get(name) if regions else None
+    if region:
+      # templates sharing a region share its crop, and so its pyramid
+      if region not in region_frames:
+        region_frames[region] = _crop_to_region(screen, region)
+      search = region_frames[region]
+    if search is None:
+      continue
+
+    # build the lazily cached images here, the jobs only read them
+    search.bgr()
+    if pyramid:
+      level = pyramid_level(template, threshold)
+      search.pyramid(level)
+      template.coarse(level)
+    jobs[name] = partial(match_in_frame, search, template, threshold, pyramid)
+    offsets[name] = (search.left - screen.left, search.top - screen.top)
+
+  for name, matches in run_parallel(jobs).items():
+    dx, dy = offsets[name]
+    boxes = [(x + dx, y + dy, w, h) for (x, y, w, h), _ in matches]
     results[name] = boxes
 
     # Debug: Log each template result
@@ -126,20 +186,133 @@ def multi_match_templates(templates, screen=None, threshold=0.85):
 
   return results
 
-def deduplicate_boxes(boxes, min_dist=5):
-  filtered = []
-  for x, y, w, h in boxes:
-    cx, cy = x + w // 2, y + h // 2
-    if all(abs(cx - (fx + fw // 2)) > min_dist or abs(cy - (fy + fh // 2)) > min_dist
-        for fx, fy, fw, fh in filtered):
-      filtered.append((x, y, w, h))
-  return filtered
+# Pyramid matching: find candidates on a downscaled frame, confirm them at full size
+MAX_PYRAMID_LEVEL = 2           # down to 1/4 scale
+MIN_PYRAMID_TEMPLATE_SIZE = 12  # smallest template side still worth matching downscaled
+PYRAMID_COARSE_MARGIN = 0.2     # coarse threshold is this much looser than the real one
+PYRAMID_SCORE_HEADROOM = 0.05   # what the background around a real match may cost a downscaled template
+PYRAMID_MAX_CANDIDATES = 8
+
+def pyramid_level(template, threshold):
+  """Deepest pyramid level where the template stays big enough, 0 means full size only.
+
+  A level also has to keep the template recognizable: downscaled at any
+  offset, the asset has to still score above the coarse threshold.
+  """
+  coarse_threshold = threshold - PYRAMID_COARSE_MARGIN + PYRAMID_SCORE_HEADROOM
+  level = 0
+  while (level < MAX_PYRAMID_LEVEL
+         and min(template.height, template.width) >> (level + 1) >= MIN_PYRAMID_TEMPLATE_SIZE
+         and template.pyramid_score(level + 1) >= coarse_threshold):
+    level += 1
+  return level
+
+def match_pyramid(frame, template, threshold):
+  """Coarse to fine matching of a Template in a Frame, same output as find_peaks.
+
+  Templates too small or too detailed to survive downscaling are matched at full size.
+  """
+  level = pyramid_level(template, threshold)
+  full = frame.bgr()
+  if level == 0:
+    result = cv2.matchTemplate(full, template.bgr, cv2.TM_CCOEFF_NORMED)
+    return find_peaks(result, (template.height, template.width), threshold)
+
+  coarse = cv2.matchTemplate(frame.pyramid(level), template.coarse(level), cv2.TM_CCOEFF_NORMED)
+  coarse_shape = template.coarse(level).shape[:2]
+  candidates = find_peaks(coarse, coarse_shape, threshold - PYRAMID_COARSE_MARGIN,
+                          max_peaks=PYRAMID_MAX_CANDIDATES)
+
+  scale = 1 << level
+  margin = 2 * scale
+  h, w = template.height, template.width
+  xs, ys, scores = [], [], []
+  for (cx, cy, _, _), _ in candidates:
+    # the coarse template starts COARSE_TRIM pixels into the asset
+    cx, cy = cx - COARSE_TRIM, cy - COARSE_TRIM
+    # refine in a window around the candidate at full resolution
+    left, top = max(cx * scale - margin, 0), max(cy * scale - margin, 0)
+    right = min(cx * scale + w + margin, full.shape[1])
+    bottom = min(cy * scale + h + margin, full.shape[0])
+    if right - left < w or bottom - top < h:
+      continue
+    result = cv2.matchTemplate(full[top:bottom, left:right], template.bgr, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    if max_val >= threshold:
+      xs.append(left + max_loc[0])
+      ys.append(top + max_loc[1])
+      scores.append(max_val)
+
+  if not scores:
+    return []
+  return suppress_overlaps(np.array(xs), np.array(ys), np.array(scores), (h, w))
+
+def _crop_to_region(screen, region):
+  # part of the frame inside region (x, y, w, h), None when they don't overlap
+  left, top, right, bottom = region_to_bbox(region)
+  frame_left, frame_top, frame_right, frame_bottom = screen.bbox
+  bbox = (max(left, frame_left), max(top, frame_top), min(right, frame_right), min(bottom, frame_bottom))
+  if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+    return None
+  return screen.crop(bbox)
+
+# Upper bound on candidates NMS looks at, keeps loose thresholds cheap
+MAX_PEAKS = 64
+
+def find_peaks(result, template_shape, threshold, min_dist=5, iou_threshold=0.5, max_peaks=MAX_PEAKS):
+  """Matches in a matchTemplate score map, as ((x, y, w, h), score) best first.
+
+  Only local maxima (within min_dist pixels) above threshold are candidates,
+  the best max_peaks of them go through NMS: a box is dropped when it
+  overlaps a better one by more than iou_threshold or its center is within
+  min_dist of it.
+  """
+  _, max_val, _, _ = cv2.minMaxLoc(result)
+  if max_val < threshold:
+    return []
+
+  ys, xs = np.nonzero(result >= threshold)
+  if len(xs) > max_peaks:
+    # keep local maxima only, dilating just the area the candidates cover
+    top, bottom = max(ys.min() - min_dist, 0), ys.max() + min_dist + 1
+    left, right = max(xs.min() - min_dist, 0), xs.max() + min_dist + 1
+    area = result[top:bottom, left:right]
+    kernel = np.ones((2 * min_dist + 1, 2 * min_dist + 1), np.uint8)
+    is_peak = area >= cv2.dilate(area, kernel)
+    keep = is_peak[ys - top, xs - left]
+    ys, xs = ys[keep], xs[keep]
+
+  scores = result[ys, xs]
+  if len(scores) > max_peaks:
+    best = np.argpartition(-scores, max_peaks)[:max_peaks]
+    ys, xs, scores = ys[best], xs[best], scores[best]
+  return suppress_overlaps(xs, ys, scores, template_shape, min_dist, iou_threshold)
+
+def suppress_overlaps(xs, ys, scores, template_shape, min_dist=5, iou_threshold=0.5):
+  """Greedy NMS over same sized boxes at (xs, ys), returns ((x, y, w, h), score) best first."""
+  order = np.argsort(-scores, kind="stable")
+  ys, xs, scores = ys[order], xs[order], scores[order]
+
+  h, w = template_shape
+  # every box has the template's size, so overlap only depends on the offsets
+  dx = np.abs(xs[:, None] - xs[None, :])
+  dy = np.abs(ys[:, None] - ys[None, :])
+  intersection = np.clip(w - dx, 0, None) * np.clip(h - dy, 0, None)
+  iou = intersection / (2 * w * h - intersection)
+  too_close = (iou > iou_threshold) | ((dx <= min_dist) & (dy <= min_dist))
+
+  suppressed = np.zeros(len(scores), bool)
+  matches = []
+  for i in range(len(scores)):
+    if suppressed[i]:
+      continue
+    matches.append(((int(xs[i]), int(ys[i]), w, h), float(scores[i])))
+    suppressed |= too_close[i]
+  return matches
 
 def is_btn_active(region, treshold = 150):
-  screenshot = capture_region(region)
-  grayscale = screenshot.convert("L")
-  stat = ImageStat.Stat(grayscale)
-  avg_brightness = stat.mean[0]
+  grayscale = grab_frame(region_to_bbox(region)).gray()
+  avg_brightness = grayscale.mean()
 
   # Treshold btn
   return avg_brightness > treshold
@@ -147,37 +320,18 @@ def is_btn_active(region, treshold = 150):
 def count_pixels_of_color(color_rgb=[117,117,117], region=None, tolerance=2):
     # [117,117,117] is gray for missing energy, we go 2 below and 2 above so that it's more stable in recognition
     if region:
-        screen = np.array(ImageGrab.grab(bbox=region))  # (left, top, right, bottom)
+        screen = grab_frame(region).bgra  # (left, top, right, bottom)
     else:
         return -1
 
-    color = np.array(color_rgb, np.uint8)
+    # match straight on the BGRA pixels, any alpha
+    color = np.array([*color_rgb[::-1], 0], np.int16)
 
     # define min/max range ±2
     color_min = np.clip(color - tolerance, 0, 255)
     color_max = np.clip(color + tolerance, 0, 255)
+    color_min[3], color_max[3] = 0, 255
 
-    dst = cv2.inRange(screen, color_min, color_max)
+    dst = cv2.inRange(screen, color_min.astype(np.uint8), color_max.astype(np.uint8))
     pixel_count = cv2.countNonZero(dst)
     return pixel_count
-
-def find_color_of_pixel(region=None):
-  if region:
-    #we can only return one pixel's color here, so we take the x, y and add 1 to them
-    region = (region[0], region[1], region[0]+1, region[1]+1)
-    screen = np.array(ImageGrab.grab(bbox=region))  # (left, top, right, bottom)
-    return screen[0]
-  else:
-    return -1
-
-def closest_color(color_dict, target_color):
-    closest_name = None
-    min_dist = float('inf')
-    target_color = np.array(target_color)
-    for name, col in color_dict.items():
-        col = np.array(col)
-        dist = np.linalg.norm(target_color - col)  # Euclidean distance
-        if dist < min_dist:
-            min_dist = dist
-            closest_name = name
-    return closest_name
@@ -0,0 +1,195 @@
+import cv2
+import numpy as np
+import time
+from pathlib import Path
+
+import utils.constants as constants
+from utils.log import warning, debug
+from utils.saved import saved_loader
+from utils.screenshot import ReplayFrameSource, region_to_bbox
+
+# Screens the bot tells apart, index labels outside this list are allowed but unused
+SCREENS = ("lobby", "training", "race_list", "race_result", "event", "skill_list", "full_stats", "loading")
+UNKNOWN = "unknown"
+
+SCREEN_INDEX_PATH = "screen_index.npz"
+HASH_SIZE = 16    # dHash over a 17x16 thumbnail, 256 bits
+ANCHOR_SIZE = 8   # anchor patches are shrunk to 8x8 grays
+# (x, y, w, h) fractions of the game column: top bar, middle, bottom buttons
+ANCHORS = ((0, 0, 1, 0.12), (0, 0.4, 1, 0.2), (0, 0.85, 1, 0.15))
+# farther than this from every indexed frame means the screen isn't known
+MAX_DISTANCE = 0.2
+
+class Fingerprint:
+  """Cheap description of a screen: a difference hash plus a few shrunk patches."""
+
+  def __init__(self, bits, anchors):
+    self.bits = bits
+    self.anchors = anchors
+
+  def distance(self, other):
+    return float(_distances(self, other.bits[None], other.anchors[None])[0])
+
+def _distances(fingerprint, bits, anchors):
+  # half hamming distance of the hashes, half mean gray difference of the anchors, both 0..1
+  hamming = (bits != fingerprint.bits).mean(axis=1)
+  anchor = np.abs(anchors - fingerprint.anchors).mean(axis=1) / 255
+  return (hamming + anchor) / 2
+
+def game_area(frame):
+  """The part of the frame showing the game column, the whole frame when they don't overlap."""
+  left, top, right, bottom = region_to_bbox(constants.GAME_WINDOW_REGION)
+  frame_left, frame_top, frame_right, frame_bottom = frame.bbox
+  bbox = (max(left, frame_left), max(top, frame_top), min(right, frame_right), min(bottom, frame_bottom))
+  if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+    return frame
+  return frame.crop(bbox)
+
+def fingerprint(frame) -> Fingerprint:
+  gray = game_area(frame).gray()
+  thumb = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+  bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+
+  h, w = gray.shape
+  patches = []
+  for ax, ay, aw, ah in ANCHORS:
+    patch = gray[int(ay * h):int((ay + ah) * h), int(ax * w):int((ax + aw) * w)]
+    patches.append(cv2.resize(patch, (ANCHOR_SIZE, ANCHOR_SIZE), interpolation=cv2.INTER_AREA).ravel())
+  return Fingerprint(bits, np.concatenate(patches).astype(np.float32))
+
+class ScreenIndex:
+  """Labeled fingerprints of recorded frames, classifies by nearest neighbour."""
+
+  def __init__(self):
+    self.labels = []
+    self.bits = np.zeros((0, HASH_SIZE * HASH_SIZE), bool)
+    self.anchors = np.zeros((0, len(ANCHORS) * ANCHOR_SIZE * ANCHOR_SIZE), np.float32)
+
+  def __len__(self):
+    return len(self.labels)
+
+  def add(self, label, fp):
+    self.labels.append(label)
+    self.bits = np.vstack([self.bits, fp.bits[None]])
+    self.anchors = np.vstack([self.anchors, fp.anchors[None]])
+
+  def nearest(self, fp, exclude=None):
+    """(label, distance) of the closest indexed frame, `exclude` skips one entry."""
+    if not self.labels:
+      return UNKNOWN, 1.0
+    distances = _distances(fp, self.bits, self.anchors)
+    if exclude is not None:
+      distances[exclude] = np.inf
+    best = int(distances.argmin())
+    return self.labels[best], float(distances[best])
+
+  def classify(self, frame):
+    label, distance = self.nearest(fingerprint(frame))
+    if distance > MAX_DISTANCE:
+      return UNKNOWN, distance
+    return label, distance
+
+  def save(self, path=SCREEN_INDEX_PATH):
+    np.savez_compressed(path, labels=np.array(self.labels), bits=np.packbits(self.bits, axis=1), anchors=self.anchors)
+
+  @classmethod
+  def load(cls, path=SCREEN_INDEX_PATH):
+    data = np.load(path)
+    index = cls()
+    index.labels = [str(label) for label in data["labels"]]
+    index.bits = np.unpackbits(data["bits"], axis=1, count=HASH_SIZE * HASH_SIZE).astype(bool)
+    index.anchors = data["anchors"]
+    return index
+
+  @classmethod
+  def build(cls, root):
+    """Index of recorded frames sorted by screen, as <root>/<label>/*.png or <root>/<label>.zip."""
+    index = cls()
+    for path in sorted(Path(root).iterdir()):
+      if not (path.is_dir() or path.suffix == ".zip"):
+        continue
+      label = path.stem if path.suffix == ".zip" else path.name
+      if label not in SCREENS:
+        warning(f"{label} is not one of the known screens {SCREENS}, indexing it anyway.")
+      source = ReplayFrameSource(path)
+      for _ in range(len(source)):
+        source.next_frame()
+        index.add(label, fingerprint(source.current()))
+      source.close()
+      debug(f"Indexed {len(source)} {label} frames")
+    return index
+
+# the index saved at SCREEN_INDEX_PATH, None when there is none
+get_screen_index = saved_loader(SCREEN_INDEX_PATH, ScreenIndex.load, "screen index with {} frames")
+
+def classify_screen(frame):
+  """Label of the screen in frame, UNKNOWN without an index or when nothing is close."""
+  index = get_screen_index()
+  if index is None:
+    return UNKNOWN
+  label, distance = index.classify(frame)
+  debug(f"Screen: {label} ({distance:.3f})")
+  return label
+
+# Change detection between cycles, on a tiny gray copy of the game column
+CHANGE_THUMB_SIZE = (48, 27)
+CHANGE_THRESHOLD = 3         # mean gray difference (0..255) that counts as the screen changing
+STABLE_SECONDS = 0.15        # the screen has to hold still this long before it's worth reading
+MAX_UNCHANGED_SECONDS = 5    # read it again after this long anyway
+MAX_MOVING_SECONDS = 2       # motion lasting longer is the screen's idle animation, not a transition
+
+MOVING = "moving"
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+
+class ChangeDetector:
+  """Tells whether a frame is worth running recognition on.
+
+  update() says MOVING while the screen is still animating, UNCHANGED when it
+  holds still and looks like the last processed frame, CHANGED otherwise.
+  A screen that keeps moving for max_moving_seconds is animated rather than
+  in transition, it counts as CHANGED until it holds still again.
+  Call processed() once the frame has been recognized.
+  """
+
+  def __init__(self, threshold=CHANGE_THRESHOLD, stable_seconds=STABLE_SECONDS,
+               max_unchanged_seconds=MAX_UNCHANGED_SECONDS, max_moving_seconds=MAX_MOVING_SECONDS):
+    self.threshold = threshold
+    self.stable_seconds = stable_seconds
+    self.max_unchanged_seconds = max_unchanged_seconds
+    self.max_moving_seconds = max_moving_seconds
+    self.reset()
+
+  def reset(self):
+    """Forget the last processed frame, the next still frame is CHANGED."""
+    self._last_seen = None
+    self._still_since = 0
+    self._moving_since = None
+    self._last_processed = None
+    self._processed_at = 0
+
+  def _differs(self, a, b):
+    return b is None or cv2.absdiff(a, b).mean() > self.threshold
+
+  def update(self, frame):
+    now = time.time()
+    thumb = cv2.resize(game_area(frame).gray(), CHANGE_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    if self._differs(thumb, self._last_seen):
+      if self._moving_since is None or now - self._still_since >= self.stable_seconds:
+        self._moving_since = now
+      self._still_since = now
+    self._last_seen = thumb
+
+    if now - self._still_since < self.stable_seconds:
+      if now - self._moving_since < self.max_moving_seconds:
+        return MOVING
+      return CHANGED
+    if (not self._differs(thumb, self._last_processed)
+        and now - self._processed_at < self.max_unchanged_seconds):
+      return UNCHANGED
+    return CHANGED
+
+  def processed(self):
+    """Mark the frame passed to the last update() as recognized."""
+    self._last_processed = self._last_seen
+    self._processed_at = time.time()
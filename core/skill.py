@@ -5,8 +5,7 @@ import Levenshtein
 import utils.constants as constants
 
 from utils.log import info, warning, error, debug
-from utils.screenshot import enhanced_screenshot
-from core.ocr import extract_text
+from core.ocr_backends import read_routed
 from core.recognizer import match_template, is_btn_active
 import core.state as state
 
@@ -23,9 +22,8 @@ def buy_skill():
 
     if buy_skill_icon:
       for x, y, w, h in buy_skill_icon:
-        region = (x - 420, y - 40, w + 275, h + 5)
-        screenshot = enhanced_screenshot(region)
-        text = extract_text(screenshot)
+        screenshot = state.skill_name_crop((x, y, w, h))
+        text, _ = read_routed(screenshot, "skill_name")
         if is_skill_match(text, state.SKILL_LIST):
           button_region = (x, y, w, h)
           if is_btn_active(button_region):
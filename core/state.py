@@ -3,13 +3,15 @@ import numpy as np
 import re
 import json
 import threading
-from math import floor
 
 from utils.log import info, warning, error, debug
 
-from utils.screenshot import capture_region, enhanced_screenshot
-from core.ocr import extract_text, extract_number
-from core.recognizer import match_template, count_pixels_of_color, find_color_of_pixel, closest_color
+from utils.screenshot import grab_frame, current_frame, region_to_bbox, union_bbox, enhanced_screenshot
+from core.ocr import extract_number, set_ocr_workers
+from core.ocr_backends import read_routed, read_routed_many, submit_routed
+from core.vocab import Mood, Turn, label_from_text
+from core.recognizer import match_template, multi_match_templates, count_pixels_of_color
+from core.templates import get_template
 
 import utils.constants as constants
 
@@ -28,6 +30,9 @@ STAT_CAPS = None
 SKILL_LIST = None
 CANCEL_CONSECUTIVE_RACE = None
 SLEEP_TIME_MULTIPLIER = 1
+CPU_BUDGET_PERCENT = 0
+OCR_WORKERS = 0
+OCR_TORCH_THREADS = 0
 
 def load_config():
   with open("config.json", "r", encoding="utf-8") as file:
@@ -38,7 +43,7 @@ def reload_config():
   global PRIORITIZE_G1_RACE, CANCEL_CONSECUTIVE_RACE, STAT_CAPS, IS_AUTO_BUY_SKILL, SKILL_PTS_CHECK, SKILL_LIST
   global PRIORITY_EFFECTS_LIST, SKIP_TRAINING_ENERGY, NEVER_REST_ENERGY, SKIP_INFIRMARY_UNLESS_MISSING_ENERGY, PREFERRED_POSITION
   global ENABLE_POSITIONS_BY_RACE, POSITIONS_BY_RACE, POSITION_SELECTION_ENABLED, SLEEP_TIME_MULTIPLIER
-  global WINDOW_NAME, RACE_SCHEDULE, CONFIG_NAME
+  global WINDOW_NAME, RACE_SCHEDULE, CONFIG_NAME, CPU_BUDGET_PERCENT, OCR_WORKERS, OCR_TORCH_THREADS
 
   config = load_config()
 
@@ -65,9 +70,30 @@ def reload_config():
   WINDOW_NAME = config["window_name"]
   RACE_SCHEDULE = config["race_schedule"]
   CONFIG_NAME = config["config_name"]
+  CPU_BUDGET_PERCENT = config.get("cpu_budget_percent", 0)
+  OCR_WORKERS = config.get("ocr_workers", 0)
+  OCR_TORCH_THREADS = config.get("ocr_torch_threads", 0)
+  set_ocr_workers(OCR_WORKERS, OCR_TORCH_THREADS)
+
+# below this the batched reading of a stat is redone with full OCR
+MIN_STAT_CONFIDENCE = 0.5
+
+# Crops of the text fields. The checks below, the glyph atlas and label bank
+# builders and bench_ocr.py all take them from here.
+# Region constant of each single crop field, looked up when used so the
+# emulator x-offset is applied
+FIELD_REGIONS = {
+  "turn": "TURN_REGION",
+  "year": "YEAR_REGION",
+  "criteria": "CRITERIA_REGION",
+  "skill_pts": "SKILL_PTS_REGION",
+  "failure": "FAILURE_REGION",
+  "race_info": "RACE_INFO_TEXT_REGION",
+  "status_effects": "FULL_STATS_STATUS_REGION",
+}
 
-# Get Stat
-def stat_state():
+def stat_crops():
+  """{stat: crop} of the five stats, cropped from one grab."""
   stat_regions = {
     "spd": constants.SPD_STAT_REGION,
     "sta": constants.STA_STAT_REGION,
@@ -75,56 +101,172 @@ def stat_state():
     "guts": constants.GUTS_STAT_REGION,
     "wit": constants.WIT_STAT_REGION
   }
+  frame = grab_frame(union_bbox([region_to_bbox(region) for region in stat_regions.values()]))
+  return {stat: enhanced_screenshot(region, frame) for stat, region in stat_regions.items()}
+
+def skill_name_crop(buy_button):
+  """Crop of the skill name next to a buy button's (x, y, w, h) box."""
+  x, y, w, h = buy_button
+  return enhanced_screenshot((x - 420, y - 40, w + 275, h + 5))
+
+def field_crop(field):
+  """Crop of a single crop field: mood in color, the others ready for OCR."""
+  if field == "mood":
+    return grab_frame(region_to_bbox(constants.MOOD_REGION)).rgb()
+  return enhanced_screenshot(getattr(constants, FIELD_REGIONS[field]))
+
+def field_crops(field):
+  """Every crop of a field on the current screen."""
+  if field == "stat":
+    return list(stat_crops().values())
+  if field == "skill_name":
+    return [skill_name_crop(box) for box in match_template("assets/icons/buy_skill.png", threshold=0.9) or []]
+  return [field_crop(field)]
+
+# Get Stat
+def stat_state():
+  return {stat: value for stat, (value, _) in read_stats().items()}
+
+def read_stats():
+  """{stat: (value, confidence)}, all five read from one frame, a batch per backend of the stat route."""
+  images = stat_crops()
+  readings = read_routed_many(list(images.values()), "stat")
 
   result = {}
-  for stat, region in stat_regions.items():
-    img = enhanced_screenshot(region)
-    val = extract_number(img)
-    result[stat] = val
+  for (stat, img), (text, confidence) in zip(images.items(), readings):
+    digits = re.sub(r"[^\d]", "", text)
+    if not digits or confidence < MIN_STAT_CONFIDENCE:
+      debug(f"Unsure {stat} reading {text!r} ({confidence:.2f}), reading it again with detection.")
+      result[stat] = (extract_number(img), confidence)
+    else:
+      result[stat] = (int(digits), confidence)
   return result
 
+SUPPORT_ICONS = {
+  "spd": get_template("assets/icons/support_card_type_spd.png"),
+  "sta": get_template("assets/icons/support_card_type_sta.png"),
+  "pwr": get_template("assets/icons/support_card_type_pwr.png"),
+  "guts": get_template("assets/icons/support_card_type_guts.png"),
+  "wit": get_template("assets/icons/support_card_type_wit.png"),
+  "friend": get_template("assets/icons/support_card_type_friend.png")
+}
+SUPPORT_HINT = get_template("assets/icons/support_hint.png")
+
+SUPPORT_FRIEND_LEVELS = {
+  "gray": [110,108,120],
+  "blue": [42,192,255],
+  "green": [162,230,30],
+  "yellow": [255,173,30],
+  "max": [255,235,120],
+}
+# the friendship bar is sampled this far below the center of a support icon
+ICON_TO_FRIEND_BAR_DISTANCE = 66
+
+def build_color_lut(colors, bits=5):
+  """Lookup table from RGB quantized to `bits` per channel to the index of the closest color."""
+  step = 1 << (8 - bits)
+  centers = np.arange(0, 256, step) + step // 2
+  grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+  distances = ((grid - np.array(colors)[None]) ** 2).sum(axis=2)
+  return distances.argmin(axis=1).astype(np.uint8).reshape(len(centers), len(centers), len(centers))
+
+FRIEND_LEVEL_NAMES = list(SUPPORT_FRIEND_LEVELS)
+FRIEND_LEVEL_LUT = build_color_lut(list(SUPPORT_FRIEND_LEVELS.values()))
+
+def friend_level_of_pixel(bgra):
+  b, g, r = (int(c) >> 3 for c in bgra[:3])
+  return FRIEND_LEVEL_NAMES[FRIEND_LEVEL_LUT[r, g, b]]
+
+# Cards sit in a fixed column of slots, relative to SUPPORT_CARD_ICON_BBOX
+SUPPORT_SLOT_OFFSET = (12, 12)  # top left of the first card's type icon
+SUPPORT_SLOT_PITCH = 101
+SUPPORT_SLOT_COUNT = 6
+SUPPORT_SLOT_JITTER = 3         # pixels an icon may sit away from its slot
+SUPPORT_SLOT_UNSURE = 0.6       # best icon score above this but under the threshold means a shifted layout
+
+def parse_support_slots(icons, threshold=0.8):
+  """{type: [boxes]} read from the fixed card slots of the icon column.
+
+  Returns None when the column doesn't look like the expected layout, the
+  caller then falls back to sliding every template over the whole column.
+  """
+  screen = icons.bgr()
+  window_w = max(icon.width for icon in SUPPORT_ICONS.values()) + 2 * SUPPORT_SLOT_JITTER
+  window_h = max(icon.height for icon in SUPPORT_ICONS.values()) + 2 * SUPPORT_SLOT_JITTER
+  found = {key: [] for key in SUPPORT_ICONS}
+  occupied = []
+  for slot in range(SUPPORT_SLOT_COUNT):
+    left = SUPPORT_SLOT_OFFSET[0] - SUPPORT_SLOT_JITTER
+    top = SUPPORT_SLOT_OFFSET[1] + slot * SUPPORT_SLOT_PITCH - SUPPORT_SLOT_JITTER
+    window = screen[top:top + window_h, left:left + window_w]
+    if window.shape[0] < window_h or window.shape[1] < window_w:
+      return None
+
+    best_key, best_score, best_loc = None, -1, None
+    for key, icon in SUPPORT_ICONS.items():
+      result = cv2.matchTemplate(window, icon.bgr, cv2.TM_CCOEFF_NORMED)
+      _, score, _, loc = cv2.minMaxLoc(result)
+      if score > best_score:
+        best_key, best_score, best_loc = key, score, loc
+
+    if best_score >= threshold:
+      icon = SUPPORT_ICONS[best_key]
+      found[best_key].append((left + best_loc[0], top + best_loc[1], icon.width, icon.height))
+      occupied.append(True)
+    elif best_score >= SUPPORT_SLOT_UNSURE:
+      return None
+    else:
+      occupied.append(False)
+
+  # cards fill the column from the top, a card below an empty slot means the
+  # layout is off. No card at all is rare enough to double check the slow way.
+  filled = occupied.count(True)
+  if filled == 0 or occupied[:filled] != [True] * filled:
+    return None
+  return found
+
+def support_panel_bbox():
+  """SUPPORT_CARD_ICON_BBOX stretched down to the friendship bar of the lowest card."""
+  left, top, right, bottom = constants.SUPPORT_CARD_ICON_BBOX
+  return (left, top, right, bottom + ICON_TO_FRIEND_BAR_DISTANCE)
+
 # Check support card in each training
 def check_support_card(threshold=0.8, target="none"):
-  SUPPORT_ICONS = {
-    "spd": "assets/icons/support_card_type_spd.png",
-    "sta": "assets/icons/support_card_type_sta.png",
-    "pwr": "assets/icons/support_card_type_pwr.png",
-    "guts": "assets/icons/support_card_type_guts.png",
-    "wit": "assets/icons/support_card_type_wit.png",
-    "friend": "assets/icons/support_card_type_friend.png"
-  }
+  return read_support_panel(grab_frame(support_panel_bbox()), threshold)
 
+def read_support_panel(panel, threshold=0.8):
+  """check_support_card's result from one Frame of support_panel_bbox()."""
   count_result = {}
-
-  SUPPORT_FRIEND_LEVELS = {
-    "gray": [110,108,120],
-    "blue": [42,192,255],
-    "green": [162,230,30],
-    "yellow": [255,173,30],
-    "max": [255,235,120],
-  }
-
   count_result["total_supports"] = 0
   count_result["total_hints"] = 0
   count_result["total_friendship_levels"] = {}
   count_result["hints_per_friend_level"] = {}
 
-  for friend_level, color in SUPPORT_FRIEND_LEVELS.items():
+  for friend_level in SUPPORT_FRIEND_LEVELS:
     count_result["total_friendship_levels"][friend_level] = 0
     count_result["hints_per_friend_level"][friend_level] = 0
 
-  hint_matches = match_template("assets/icons/support_hint.png", constants.SUPPORT_CARD_ICON_BBOX, threshold)
-  for key, icon_path in SUPPORT_ICONS.items():
+  icons = panel.crop(constants.SUPPORT_CARD_ICON_BBOX)
+  panel_matches = parse_support_slots(icons, threshold)
+  if panel_matches is None:
+    debug("Support slots don't match the expected layout, searching the whole column.")
+    # the hint and the six icons are searched side by side in the icon column
+    panel_matches = multi_match_templates(dict(SUPPORT_ICONS, hint=SUPPORT_HINT), screen=icons, threshold=threshold)
+  else:
+    # hint badges don't sit at a fixed spot of the slot
+    panel_matches.update(multi_match_templates({"hint": SUPPORT_HINT}, screen=icons, threshold=threshold))
+  hint_matches = panel_matches["hint"]
+  offset_x, offset_y = icons.left - panel.left, icons.top - panel.top
+  for key in SUPPORT_ICONS:
     count_result[key] = {}
     count_result[key]["supports"] = 0
     count_result[key]["hints"] = 0
     count_result[key]["friendship_levels"]={}
 
-    for friend_level, color in SUPPORT_FRIEND_LEVELS.items():
+    for friend_level in SUPPORT_FRIEND_LEVELS:
       count_result[key]["friendship_levels"][friend_level] = 0
 
-    matches = match_template(icon_path, constants.SUPPORT_CARD_ICON_BBOX, threshold)
-    for match in matches:
+    for match in panel_matches[key]:
       # add the support as a specific key
       count_result[key]["supports"] += 1
       # also add it to the grand total
@@ -132,14 +274,9 @@ def check_support_card(threshold=0.8, target="none"):
 
       #find friend colors and add them to their specific colors
       x, y, w, h = match
-      match_horizontal_middle = floor((2*x+w)/2)
-      match_vertical_middle = floor((2*y+h)/2)
-      icon_to_friend_bar_distance = 66
-      bbox_left = match_horizontal_middle + constants.SUPPORT_CARD_ICON_BBOX[0]
-      bbox_top = match_vertical_middle + constants.SUPPORT_CARD_ICON_BBOX[1] + icon_to_friend_bar_distance
-      wanted_pixel = (bbox_left, bbox_top, bbox_left+1, bbox_top+1)
-      friendship_level_color = find_color_of_pixel(wanted_pixel)
-      friend_level = closest_color(SUPPORT_FRIEND_LEVELS, friendship_level_color)
+      bar_x = offset_x + (2*x+w)//2
+      bar_y = min(offset_y + (2*y+h)//2 + ICON_TO_FRIEND_BAR_DISTANCE, panel.height - 1)
+      friend_level = friend_level_of_pixel(panel.bgra[bar_y, bar_x])
       count_result[key]["friendship_levels"][friend_level] += 1
       count_result["total_friendship_levels"][friend_level] += 1
 
@@ -155,50 +292,48 @@ def check_support_card(threshold=0.8, target="none"):
 
 # Get failure chance (idk how to get energy value)
 def check_failure():
-  failure = enhanced_screenshot(constants.FAILURE_REGION)
-  failure_text = extract_text(failure).lower()
+  failure = field_crop("failure")
+
+  failure_text, _ = read_routed(failure, "failure")
+  failure_text = failure_text.lower()
 
   if not failure_text.startswith("failure"):
     return -1
 
-  # SAFE CHECK
-  # 1. If there is a %, extract the number before the %
-  match_percent = re.search(r"failure\s+(\d{1,3})%", failure_text)
+  match_percent = re.search(r"failure\s+(\d{1,3})\s*%", failure_text)
   if match_percent:
     return int(match_percent.group(1))
 
-  # 2. If there is no %, but there is a 9, extract digits before the 9
+  # no % sign, it's often misread as a 9: keep the digits before the 9
   match_number = re.search(r"failure\s+(\d+)", failure_text)
   if match_number:
     digits = match_number.group(1)
     idx = digits.find("9")
     if idx > 0:
-      num = digits[:idx]
-      return int(num) if num.isdigit() else -1
-    elif digits.isdigit():
-      return int(digits)  # fallback
+      return int(digits[:idx])
+    return int(digits)
 
+  warning(f"Failure chance not recognized: {failure_text}")
   return -1
 
 # Check mood
 def check_mood():
-  mood = capture_region(constants.MOOD_REGION)
-  mood_text = extract_text(mood).upper()
-
-  for known_mood in constants.MOOD_LIST:
-    if known_mood in mood_text:
-      return known_mood
+  mood = field_crop("mood")
+  mood_text, _ = read_routed(mood, "mood")
+  label = label_from_text(mood_text, "mood")
+  if label is not None:
+    return label
 
   warning(f"Mood not recognized: {mood_text}")
-  return "UNKNOWN"
+  return Mood.UNKNOWN
 
 # Check turn
 def check_turn():
-    turn = enhanced_screenshot(constants.TURN_REGION)
-    turn_text = extract_text(turn)
+    turn = field_crop("turn")
+    turn_text, _ = read_routed(turn, "turn")
 
-    if "Race Day" in turn_text:
-        return "Race Day"
+    if label_from_text(turn_text, "turn") is not None:
+        return Turn.RACE_DAY
 
     # sometimes easyocr misreads characters instead of numbers
     cleaned_text = (
@@ -218,30 +353,118 @@ def check_turn():
 
 # Check year
 def check_current_year():
-  year = enhanced_screenshot(constants.YEAR_REGION)
-  text = extract_text(year)
-  return text
+  year = field_crop("year")
+  text, _ = read_routed(year, "year")
+  # a reading off the vocabulary is still passed on as is
+  return label_from_text(text, "year") or text
 
 # Check criteria
+def submit_criteria():
+  """Future of the criteria reading, the other fields can be checked meanwhile."""
+  img = field_crop("criteria")
+  return submit_routed(img, "criteria")
+
 def check_criteria():
-  img = enhanced_screenshot(constants.CRITERIA_REGION)
-  text = extract_text(img)
+  text, _ = submit_criteria().result()
   return text
 
 def check_skill_pts():
-  img = enhanced_screenshot(constants.SKILL_PTS_REGION)
-  text = extract_number(img)
-  return text
+  img = field_crop("skill_pts")
+  text, _ = read_routed(img, "skill_pts")
+  digits = re.sub(r"[^\d]", "", text)
+  return int(digits) if digits else -1
+
+ENERGY_BAR_RIGHT_END = get_template("assets/ui/energy_bar_right_end_part.png")
+# longer energy bars get more round at the end
+ENERGY_BAR_RIGHT_END_ROUND = get_template("assets/ui/energy_bar_right_end_part_2.png")
 
 previous_right_bar_match=""
 
+HUNDRED_ENERGY_PIXELS = 236    # counted pixels from one end of the bar to the other at 100 energy, 1080p only
+ENERGY_MISSING_GRAY = 117      # [117,117,117] is gray for missing energy
+ENERGY_MIN_BAR_PIXELS = 20     # skip the start of the row so the left border can't pass for the right one
+ENERGY_MIN_CONFIDENCE = 0.9
+
+def read_energy_row(row):
+  """(energy, max_energy, confidence) from a BGRA pixel row through the bar, starting at its left end.
+
+  Pixels are split in runs of bar fill (saturated), missing energy (gray 117)
+  and anything else. The bar ends at its dark, neutral right border; the
+  confidence is the share of the bar explained by fill followed by one gray run.
+  Returns None when there's no border.
+  """
+  rgb = row[:, 2::-1].astype(np.int16)
+  value = rgb.max(axis=1)
+  spread = value - rgb.min(axis=1)
+  border = np.flatnonzero((value[ENERGY_MIN_BAR_PIXELS:] < 100) & (spread[ENERGY_MIN_BAR_PIXELS:] <= 12))
+  if not len(border):
+    return None
+  # same as the x of the right end template inside ENERGY_BBOX
+  energy_bar_length = ENERGY_MIN_BAR_PIXELS + int(border[0]) - 2
+
+  bar = rgb[:energy_bar_length]
+  missing = (np.abs(bar - ENERGY_MISSING_GRAY) <= 2).all(axis=1)
+  filled = spread[:energy_bar_length] >= 40
+  empty_energy_pixel_count = int(missing.sum())
+
+  # 1 fill, 2 missing, 0 unexplained, over the bar without its rounded ends
+  labels = (filled.astype(np.int8) + 2 * missing)[2:-2]
+  if not len(labels):
+    return None
+  runs = labels[np.flatnonzero(np.diff(labels, prepend=-1))]
+  runs = runs[runs != 0]
+  confidence = float((labels != 0).mean())
+  if (runs[:-1] == 2).any():
+    # missing energy should be one run at the right end of the bar
+    confidence /= 2
+
+  #use the energy_bar_length (a few extra pixels from the outside are remaining so we subtract that)
+  total_energy_length = energy_bar_length - 1
+  energy_level = ((total_energy_length - empty_energy_pixel_count) / HUNDRED_ENERGY_PIXELS) * 100
+  max_energy = total_energy_length / HUNDRED_ENERGY_PIXELS * 100
+  return energy_level, max_energy, confidence
+
+_energy_cache = (None, None)
+
+def measure_energy(threshold=0.85):
+  """(energy, max_energy, confidence), read once per cycle frame.
+
+  The bar's middle row is scanned first, the right end templates are the
+  fallback when that reading isn't trusted.
+  """
+  global _energy_cache
+  bbox = constants.ENERGY_BBOX
+  cycle_frame = current_frame()
+  if cycle_frame is not None and cycle_frame.contains(bbox):
+    if _energy_cache[0] is cycle_frame:
+      return _energy_cache[1]
+  else:
+    cycle_frame = None
+
+  left, top, right, bottom = bbox
+  frame = grab_frame(bbox)
+  reading = read_energy_row(frame.bgra[(top + bottom) // 2 - frame.top])
+  if reading is None or reading[2] < ENERGY_MIN_CONFIDENCE:
+    debug(f"Energy row scan not trusted ({reading}), matching the bar end instead.")
+    energy_level, max_energy = check_energy_level_by_template(threshold)
+    reading = (energy_level, max_energy, 1.0 if energy_level >= 0 else 0.0)
+  else:
+    info(f"Remaining energy guestimate = {reading[0]:.2f}, max = {reading[1]:.2f}, confidence = {reading[2]:.2f}")
+
+  if cycle_frame is not None:
+    _energy_cache = (cycle_frame, reading)
+  return reading
+
 def check_energy_level(threshold=0.85):
+  energy_level, max_energy, _ = measure_energy(threshold)
+  return energy_level, max_energy
+
+def check_energy_level_by_template(threshold=0.85):
   # find where the right side of the bar is on screen
   global previous_right_bar_match
-  right_bar_match = match_template("assets/ui/energy_bar_right_end_part.png", constants.ENERGY_BBOX, threshold)
-  # longer energy bars get more round at the end
+  right_bar_match = match_template(ENERGY_BAR_RIGHT_END, constants.ENERGY_BBOX, threshold)
   if not right_bar_match:
-    right_bar_match = match_template("assets/ui/energy_bar_right_end_part_2.png", constants.ENERGY_BBOX, threshold)
+    right_bar_match = match_template(ENERGY_BAR_RIGHT_END_ROUND, constants.ENERGY_BBOX, threshold)
 
   if right_bar_match:
     x, y, w, h = right_bar_match[0]
@@ -272,8 +495,8 @@ def check_energy_level(threshold=0.85):
     return -1, -1
 
 def get_race_type():
-  race_info_screen = enhanced_screenshot(constants.RACE_INFO_TEXT_REGION)
-  race_info_text = extract_text(race_info_screen)
+  race_info_screen = field_crop("race_info")
+  race_info_text, _ = read_routed(race_info_screen, "race_info")
   debug(f"Race info text: {race_info_text}")
   return race_info_text
 
@@ -318,9 +541,9 @@ GOOD_STATUS_EFFECTS={
 }
 
 def check_status_effects():
-  status_effects_screen = enhanced_screenshot(constants.FULL_STATS_STATUS_REGION)
+  status_effects_screen = field_crop("status_effects")
 
-  screen = np.array(status_effects_screen)  # currently grayscale
+  screen = status_effects_screen  # currently grayscale
   screen = cv2.cvtColor(screen, cv2.COLOR_GRAY2BGR)  # convert to 3-channel BGR for display
 
   cv2.namedWindow("image")
@@ -328,7 +551,7 @@ def check_status_effects():
   cv2.imshow("image", screen)
   cv2.waitKey(5)
 
-  status_effects_text = extract_text(status_effects_screen)
+  status_effects_text, _ = read_routed(status_effects_screen, "status_effects")
   debug(f"Status effects text: {status_effects_text}")
 
   normalized_text = status_effects_text.lower().replace(" ", "")
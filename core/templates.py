@@ -0,0 +1,152 @@
+import cv2
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.log import debug, warning
+
+ASSETS_DIR = Path("assets")
+
+# race banners are only looked at on a few turns, they're loaded on first use
+# and only the most recently used ones are kept
+EVICTABLE_DIRS = ("assets/races/",)
+MAX_EVICTABLE = 8
+
+# pixels trimmed off each side of a downscaled template, see Template.coarse
+COARSE_TRIM = 1
+
+class Template:
+  """An asset decoded once, with the variants the matchers need."""
+
+  def __init__(self, path, image):
+    self.path = path
+    self.name = Path(path).stem
+    self.mask = None
+    if image.ndim == 2:
+      self.bgr = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif image.shape[2] == 4:
+      self.bgr = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+      alpha = image[:, :, 3]
+      if alpha.min() < 255:
+        self.mask = alpha
+    else:
+      self.bgr = image
+    self.gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+    self._pyramid = [self.bgr]
+    self._pyramid_scores = {}
+
+  @property
+  def width(self):
+    return self.bgr.shape[1]
+
+  @property
+  def height(self):
+    return self.bgr.shape[0]
+
+  def pyramid(self, level):
+    """BGR variant halved `level` times, scaled the same way as Frame.pyramid."""
+    while len(self._pyramid) <= level:
+      self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+    return self._pyramid[level]
+
+  def coarse(self, level):
+    """pyramid(level) without its outer pixels, the ones downscaling blends with whatever surrounds the asset."""
+    if level == 0:
+      return self.bgr
+    image = self.pyramid(level)
+    return image[COARSE_TRIM:image.shape[0] - COARSE_TRIM, COARSE_TRIM:image.shape[1] - COARSE_TRIM]
+
+  def pyramid_score(self, level):
+    """Worst score coarse(level) gets on a downscaled frame holding the asset.
+
+    Frames are halved from their own origin, so every offset of the asset to
+    that grid is tried, on a black and on a white background.
+    """
+    if level not in self._pyramid_scores:
+      scale = 1 << level
+      worst = 1.0
+      for background in ((0, 0, 0), (255, 255, 255)):
+        padded = cv2.copyMakeBorder(self.bgr, scale, scale, scale, scale, cv2.BORDER_CONSTANT, value=background)
+        for dy in range(scale):
+          for dx in range(scale):
+            shifted = padded[dy:dy + self.height + scale, dx:dx + self.width + scale]
+            for _ in range(level):
+              shifted = cv2.pyrDown(shifted)
+            result = cv2.matchTemplate(shifted, self.coarse(level), cv2.TM_CCOEFF_NORMED)
+            worst = min(worst, float(result.max()))
+      self._pyramid_scores[level] = worst
+    return self._pyramid_scores[level]
+
+  def __repr__(self):
+    return f"Template({self.path!r})"
+
+class TemplateRegistry:
+  """Process wide cache of decoded templates, keyed by asset path."""
+
+  def __init__(self, max_evictable=MAX_EVICTABLE):
+    self.max_evictable = max_evictable
+    self._pinned = {}
+    self._evictable = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def _is_evictable(self, key):
+    return key.startswith(EVICTABLE_DIRS)
+
+  def _load(self, key):
+    image = cv2.imread(key, cv2.IMREAD_UNCHANGED)
+    if image is None:
+      raise FileNotFoundError(f"Template not found: {key}")
+    return Template(key, image)
+
+  def get(self, path) -> Template:
+    key = Path(path).as_posix()
+    with self._lock:
+      template = self._pinned.get(key)
+      if template is None and key in self._evictable:
+        self._evictable.move_to_end(key)
+        template = self._evictable[key]
+      if template is not None:
+        self.hits += 1
+        return template
+
+      self.misses += 1
+      template = self._load(key)
+      if self._is_evictable(key):
+        self._evictable[key] = template
+        while len(self._evictable) > self.max_evictable:
+          evicted, _ = self._evictable.popitem(last=False)
+          debug(f"Evicted template {evicted}")
+      else:
+        self._pinned[key] = template
+      return template
+
+  def preload(self, root=ASSETS_DIR):
+    """Decode every non evictable asset under root."""
+    loaded = 0
+    for path in sorted(Path(root).rglob("*.png")):
+      key = path.as_posix()
+      if self._is_evictable(key) or key in self._pinned:
+        continue
+      try:
+        self.get(key)
+        loaded += 1
+      except FileNotFoundError as e:
+        warning(str(e))
+    debug(f"Preloaded {loaded} templates")
+    return loaded
+
+  def __len__(self):
+    return len(self._pinned) + len(self._evictable)
+
+registry = TemplateRegistry()
+
+def get_template(template) -> Template:
+  """Template handle for an asset path, handles are passed through as they are."""
+  if isinstance(template, Template):
+    return template
+  return registry.get(template)
+
+def preload_templates():
+  return registry.preload()
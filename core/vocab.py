@@ -0,0 +1,137 @@
+import re
+import cv2
+import numpy as np
+from enum import Enum
+
+from utils.log import debug
+from utils.saved import saved_loader
+
+# Mood, year and the Race Day turn label can only take a few dozen values, the
+# crop is matched against saved renderings of each instead of being read with OCR.
+LABEL_BANK_PATH = "label_bank.npz"
+HASH_SIZE = (64, 16)        # text mask shrunk to 64x16, 1024 bits
+MAX_LABEL_DISTANCE = 0.1    # share of differing bits up to which a rendering is the same label
+MIN_LABEL_MARGIN = 0.005    # the closest other label has to be at least this much farther
+MAX_SAMPLES_PER_LABEL = 8
+
+class Label(str, Enum):
+  """Closed vocabulary value, compares and formats as the text shown in game."""
+
+  def __str__(self):
+    return self.value
+
+  def __format__(self, spec):
+    return format(self.value, spec)
+
+class Mood(Label):
+  # same order as constants.MOOD_LIST
+  AWFUL = "AWFUL"
+  BAD = "BAD"
+  NORMAL = "NORMAL"
+  GOOD = "GOOD"
+  GREAT = "GREAT"
+  UNKNOWN = "UNKNOWN"
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+YEAR_LABELS = (
+  ["Junior Year Pre-Debut"]
+  + [f"{year} Year {half} {month}" for year in ("Junior", "Classic", "Senior")
+     for month in MONTHS for half in ("Early", "Late")]
+  + ["Finale Season"]
+)
+Year = Label("Year", [(re.sub(r"\W+", "_", label).upper(), label) for label in YEAR_LABELS])
+
+class Turn(Label):
+  RACE_DAY = "Race Day"
+
+VOCABULARIES = {"mood": Mood, "year": Year, "turn": Turn}
+
+def label_hash(img):
+  """Bits of a label crop's text, binarized and cropped to its ink so a shifted crop hashes the same."""
+  gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+  _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+  # text is the minority of the pixels, whether it's darker or lighter
+  if mask.mean() > 127:
+    mask = 255 - mask
+  ys, xs = np.nonzero(mask)
+  if len(xs):
+    mask = mask[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+  thumb = cv2.resize(mask, HASH_SIZE, interpolation=cv2.INTER_AREA)
+  return (thumb >= 128).ravel()
+
+def label_from_text(text, field):
+  """Vocabulary member an OCR reading of the field stands for, None when it's none of them."""
+  text = " ".join(text.split())
+  if field == "mood":
+    text = text.upper()
+    return next((mood for mood in Mood if mood != Mood.UNKNOWN and mood.value in text), None)
+  if field == "turn":
+    return Turn.RACE_DAY if "Race Day" in text else None
+  return next((label for label in VOCABULARIES[field] if label.value == text), None)
+
+class LabelBank:
+  """Hashes of labeled crops per field, classifies by nearest neighbour."""
+
+  def __init__(self):
+    self.fields = {}
+
+  def __len__(self):
+    return sum(len(labels) for labels, _ in self.fields.values())
+
+  def add(self, field, label, img):
+    labels, bits = self.fields.get(field, ([], np.zeros((0, HASH_SIZE[0] * HASH_SIZE[1]), bool)))
+    if labels.count(label) >= MAX_SAMPLES_PER_LABEL:
+      return
+    self.fields[field] = (labels + [str(label)], np.vstack([bits, label_hash(img)[None]]))
+
+  def nearest(self, field, img):
+    """[(label, distance)] of the closest sample of each label, closest first."""
+    if field not in self.fields:
+      return []
+    labels, bits = self.fields[field]
+    distances = (bits != label_hash(img)).mean(axis=1)
+    closest = {}
+    for label, distance in zip(labels, distances):
+      closest[label] = min(closest.get(label, 1.0), float(distance))
+    return sorted(closest.items(), key=lambda item: item[1])
+
+  def classify(self, field, img):
+    """(vocabulary member or None, distance) of a crop, None when no label is close enough and clear of the rest."""
+    ranked = self.nearest(field, img)
+    if not ranked:
+      return None, 1.0
+    label, distance = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 1.0
+    if distance > MAX_LABEL_DISTANCE or runner_up - distance < MIN_LABEL_MARGIN:
+      return None, distance
+    return VOCABULARIES[field](label), distance
+
+  def save(self, path=LABEL_BANK_PATH):
+    arrays = {}
+    for field, (labels, bits) in self.fields.items():
+      arrays[f"{field}_labels"] = np.array(labels)
+      arrays[f"{field}_bits"] = np.packbits(bits, axis=1)
+    np.savez_compressed(path, **arrays)
+
+  @classmethod
+  def load(cls, path=LABEL_BANK_PATH):
+    data = np.load(path)
+    bank = cls()
+    for key in data.files:
+      if key.endswith("_labels"):
+        field = key[:-len("_labels")]
+        bits = np.unpackbits(data[f"{field}_bits"], axis=1, count=HASH_SIZE[0] * HASH_SIZE[1]).astype(bool)
+        bank.fields[field] = ([str(label) for label in data[key]], bits)
+    return bank
+
+# the bank saved at LABEL_BANK_PATH, None when there is none
+get_label_bank = saved_loader(LABEL_BANK_PATH, LabelBank.load, "label bank with {} renderings")
+
+def read_label(img, field, bank=None):
+  """(vocabulary member or None, distance) of a mood, year or turn crop."""
+  bank = bank or get_label_bank()
+  if bank is None:
+    return None, 1.0
+  label, distance = bank.classify(field, img)
+  debug(f"Label {field}: {label} ({distance:.3f})")
+  return label, distance
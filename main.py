@@ -11,10 +11,14 @@ import utils.constants as constants
 from utils.log import info, warning, error, debug
 
 from core.execute import career_lobby
+from core.locator import locator
+from core.templates import preload_templates
+from core.ocr import start_warm_up
 import core.state as state
 from server.main import app
 from update_config import update_config
 from utils.debug_mode import enable_debug_mode, disable_debug_mode
+from utils.screenshot import close_capture_session, get_frame_source, set_frame_source, LiveFrameSource
 
 hotkey = "f1"
 debug_hotkey = "f2"  # Toggle debug mode
@@ -47,9 +51,9 @@ def focus_umamusume():
       pyautogui.press("esc")
       pyautogui.press("f11")
       time.sleep(5)
-      close_btn = pyautogui.locateCenterOnScreen("assets/buttons/bluestacks/close_btn.png", confidence=0.8, minSearchTime=2)
+      close_btn = locator.wait_for("assets/buttons/bluestacks/close_btn.png", timeout=2)
       if close_btn:
-        pyautogui.click(close_btn)
+        pyautogui.click(close_btn.center)
       return True
 
     if target_window.isMinimized:
@@ -74,6 +78,11 @@ def main():
   if "--step" in sys.argv or "-s" in sys.argv:
     enable_debug_mode(show_zones=True, step_mode=True)
     info("Step-by-step debug mode enabled via command line")
+  if "--record" in sys.argv:
+    # python main.py --record <dir>: save every cycle's screen for replay.py
+    record_dir = sys.argv[sys.argv.index("--record") + 1]
+    set_frame_source(LiveFrameSource(record_dir=record_dir))
+    info(f"Recording frames to {record_dir}")
 
   try:
     state.reload_config()
@@ -89,6 +98,9 @@ def main():
     error(f"Error in main thread: {e}")
   finally:
     disable_debug_mode()
+    close_capture_session()
+    # let a recording finish writing its frames
+    get_frame_source().close()
     debug("[BOT] Stopped.")
 
 def toggle_debug_mode():
@@ -174,5 +186,10 @@ def start_server():
 
 if __name__ == "__main__":
   update_config()
+  # decode every asset once, matching never touches the disk afterwards
+  preload_templates()
+  # the OCR model loads while the config server starts, in the worker processes if configured
+  state.reload_config()
+  start_warm_up()
   threading.Thread(target=hotkey_listener, daemon=True).start()
   start_server()
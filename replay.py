@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Run the recognition stack over a recorded session, no game window needed
+Record one with: python main.py --record <dir>
+Usage: python replay.py <frames dir or .zip> [--ocr] [--passes N] [--bench-matching]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import time
+from collections import defaultdict
+
+from utils.screenshot import ReplayFrameSource, set_frame_source, capture_frame, grab_frame
+from core.recognizer import multi_match_templates, set_match_workers, MAX_MATCH_WORKERS
+from core.templates import preload_templates
+import core.state as state
+import utils.constants as constants
+
+def lobby_probe(frame):
+  matches = multi_match_templates(constants.LOBBY_TEMPLATES, screen=frame, pyramid=True)
+  return [name for name, boxes in matches.items() if boxes]
+
+def energy_probe(frame):
+  return state.check_energy_level()
+
+def support_probe(frame):
+  return state.check_support_card()["total_supports"]
+
+PROBES = {
+  "lobby": lobby_probe,
+  "energy": energy_probe,
+  "supports": support_probe,
+}
+
+OCR_PROBES = {
+  "mood": lambda frame: state.check_mood(),
+  "turn": lambda frame: state.check_turn(),
+  "year": lambda frame: state.check_current_year(),
+  "criteria": lambda frame: state.check_criteria(),
+  "stats": lambda frame: state.stat_state(),
+}
+
+def lobby_matching(frame):
+  multi_match_templates(constants.LOBBY_TEMPLATES, screen=frame, pyramid=True)
+
+def training_matching(frame):
+  panel = grab_frame(constants.SUPPORT_CARD_ICON_BBOX)
+  multi_match_templates(dict(state.SUPPORT_ICONS, hint=state.SUPPORT_HINT), screen=panel, threshold=0.8)
+
+def bench_matching(source, passes):
+  """Time the lobby and training screen matches single threaded and on the pool."""
+  runs = {"lobby": lobby_matching, "training": training_matching}
+  frames = len(source) * passes
+  timings = {}
+  for workers in sorted({1, MAX_MATCH_WORKERS}):
+    set_match_workers(workers)
+    for name, run in runs.items():
+      source.index = -1
+      elapsed = 0
+      for _ in range(frames):
+        frame = capture_frame()
+        start = time.perf_counter()
+        run(frame)
+        elapsed += time.perf_counter() - start
+      timings[name, workers] = elapsed / frames
+  set_match_workers(MAX_MATCH_WORKERS)
+
+  for name in runs:
+    single = timings[name, 1]
+    pooled = timings[name, MAX_MATCH_WORKERS]
+    print(f"  {name:<10} 1 worker {single * 1000:8.2f} ms   {MAX_MATCH_WORKERS} workers {pooled * 1000:8.2f} ms"
+          f"   speedup x{single / pooled:.2f}")
+
+def main():
+  parser = argparse.ArgumentParser(description="Replay recorded frames through the recognizers")
+  parser.add_argument("path", help="directory or .zip of recorded PNG frames")
+  parser.add_argument("--ocr", action="store_true", help="also run the OCR probes")
+  parser.add_argument("--passes", type=int, default=1, help="times to go through the recording")
+  parser.add_argument("--bench-matching", action="store_true",
+                      help="compare template matching on one thread and on the matching pool")
+  args = parser.parse_args()
+
+  preload_templates()
+  source = ReplayFrameSource(args.path, loop=True)
+  set_frame_source(source)
+  if args.bench_matching:
+    print("=== Matching benchmark ===")
+    bench_matching(source, args.passes)
+    return
+  probes = dict(PROBES, **OCR_PROBES) if args.ocr else PROBES
+
+  timings = defaultdict(list)
+  frames = len(source) * args.passes
+  start = time.perf_counter()
+  for _ in range(frames):
+    frame = capture_frame()
+    results = {}
+    for name, probe in probes.items():
+      probe_start = time.perf_counter()
+      results[name] = probe(frame)
+      timings[name].append(time.perf_counter() - probe_start)
+    print(f"{os.path.basename(source.current_name())}: {results}")
+  elapsed = time.perf_counter() - start
+
+  print("\n=== Replay summary ===")
+  print(f"{frames} frames in {elapsed:.2f}s ({frames / elapsed:.1f} frames/s)")
+  for name, values in timings.items():
+    print(f"  {name:<10} avg {sum(values) / len(values) * 1000:8.2f} ms   max {max(values) * 1000:8.2f} ms")
+
+if __name__ == "__main__":
+  main()
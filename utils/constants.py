@@ -8,6 +8,10 @@ SKIP_BTN_BIG_REGION_LANDSCAPE=(1500, 750, 1920-1500, 1080-750)
 SCREEN_BOTTOM_REGION=(125, 800, 1000-125, 1080-800)
 SCREEN_MIDDLE_REGION=(125, 300, 1000-125, 800-300)
 SCREEN_TOP_REGION=(125, 0, 1000-125, 300)
+GAME_WINDOW_REGION=(125, 0, 1000-125, 1080)
+TAZUNA_HINT_REGION=(125, 150, 450-125, 450-150)
+INSPIRATION_REGION=(125, 600, 1000-125, 900-600)
+DIALOG_BUTTONS_REGION=(125, 700, 1000-125, 1080-700)
 RACE_INFO_TEXT_REGION=(285, 335, 810-285, 370-335)
 FULL_STATS_STATUS_REGION=(265, 575, 845-265, 940-575)
 RACE_LIST_BOX_REGION=(260, 580, 850-265, 870-580)
@@ -28,6 +32,45 @@ SUPPORT_CARD_ICON_BBOX=(845, 155, 945, 700)
 ENERGY_BBOX=(440, 120, 800, 160)
 RACE_BUTTON_IN_RACE_BBOX_LANDSCAPE=(800, 950, 1150, 1050)
 
+# Everything career_lobby looks for on each cycle
+LOBBY_TEMPLATES = {
+  "event": "assets/icons/event_choice_1.png",
+  "inspiration": "assets/buttons/inspiration_btn.png",
+  "next": "assets/buttons/next_btn.png",
+  "next2": "assets/buttons/next2_btn.png",
+  "cancel": "assets/buttons/cancel_btn.png",
+  "tazuna": "assets/ui/tazuna_hint.png",
+  "infirmary": "assets/buttons/infirmary_btn.png",
+  "retry": "assets/buttons/retry_btn.png"
+}
+
+# Where each lobby template can show up. Values are names of the region
+# constants above, looked up when used so the emulator x-offset is applied.
+LOBBY_TEMPLATE_REGIONS = {
+  "event": "SCREEN_MIDDLE_REGION",
+  "inspiration": "INSPIRATION_REGION",
+  "next": "SCREEN_BOTTOM_REGION",
+  "next2": "SCREEN_BOTTOM_REGION",
+  "cancel": "DIALOG_BUTTONS_REGION",
+  "tazuna": "TAZUNA_HINT_REGION",
+  "infirmary": "SCREEN_BOTTOM_REGION",
+  "retry": "SCREEN_BOTTOM_REGION"
+}
+
+# Lobby templates worth looking for on each screen the classifier knows (core/screen.py),
+# screens not listed here get all of them
+SCREEN_LOBBY_TEMPLATES = {
+  "lobby": ["inspiration", "cancel", "tazuna", "infirmary"],
+  "event": ["event"],
+  "race_result": ["next", "next2", "retry"],
+  "loading": []
+}
+
+def resolve_regions(manifest):
+    """{template name: region constant name} -> {template name: (x, y, w, h)}"""
+    g = globals()
+    return {name: g[region_name] for name, region_name in manifest.items()}
+
 OFFSET_APPLIED = False
 def adjust_constants_x_coords(offset=405):
     """Shift all region tuples' x-coordinates by `offset`."""
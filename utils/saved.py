@@ -0,0 +1,23 @@
+from pathlib import Path
+
+from utils.log import info
+
+def saved_loader(path, load, description):
+  """Getter of what `load(path)` returns, loaded on its first call. It returns None when there is no file.
+
+  `description` names what was loaded and is formatted with its size, e.g.
+  "glyph atlas with {} glyphs".
+  """
+  loaded = None
+
+  def get():
+    nonlocal loaded
+    if loaded is None:
+      if not Path(path).exists():
+        loaded = False
+      else:
+        loaded = load(path)
+        info(f"Loaded {description.format(len(loaded))}.")
+    return loaded if loaded is not False else None
+
+  return get
@@ -1,7 +1,8 @@
 import pyautogui
 from utils.tools import get_secs
+from core.locator import locator
 
 def ura():
-  race_btn = pyautogui.locateCenterOnScreen("assets/ura/ura_race_btn.png", confidence=0.8, minSearchTime=get_secs(5))
+  race_btn = locator.wait_for("assets/ura/ura_race_btn.png", timeout=get_secs(5))
   if race_btn:
-    pyautogui.click(race_btn)
\ No newline at end of file
+    pyautogui.click(race_btn.center)
\ No newline at end of file
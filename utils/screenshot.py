@@ -1,35 +1,432 @@
-from PIL import Image, ImageEnhance
+import cv2
 import mss
 import numpy as np
+import queue
+import threading
+import time
+import zipfile
+from pathlib import Path
 
-def enhanced_screenshot(region=(0, 0, 1920, 1080)) -> Image.Image:
-  with mss.mss() as sct:
-    monitor = {
-      "left": region[0],
-      "top": region[1],
-      "width": region[2],
-      "height": region[3]
-    }
-    img = sct.grab(monitor)
-    img_np = np.array(img)
-    img_rgb = img_np[:, :, :3][:, :, ::-1]
-    pil_img = Image.fromarray(img_rgb)
-
-  pil_img = pil_img.resize((pil_img.width * 2, pil_img.height * 2), Image.BICUBIC)
-  pil_img = pil_img.convert("L")
-  pil_img = ImageEnhance.Contrast(pil_img).enhance(1.5)
-
-  return pil_img
-
-def capture_region(region=(0, 0, 1920, 1080)) -> Image.Image:
-  with mss.mss() as sct:
-    monitor = {
-      "left": region[0],
-      "top": region[1],
-      "width": region[2],
-      "height": region[3]
+from utils.log import warning
+
+# Frame shared by every probe of the current bot cycle, see capture_frame()
+_frame_context = threading.local()
+
+class Frame:
+  """BGRA pixels of a screen rectangle and where that rectangle sits on screen.
+
+  This is the image type passed between capture, recognizer and OCR. Crops are
+  numpy views into the same buffer, and the BGR / gray / RGB conversions are
+  made at most once per frame and shared with its crops.
+  """
+
+  def __init__(self, bgra, left=0, top=0):
+    self.bgra = bgra
+    self.left = left
+    self.top = top
+    self._bgr = None
+    self._gray = None
+    self._pyramid = None
+
+  @property
+  def width(self):
+    return self.bgra.shape[1]
+
+  @property
+  def height(self):
+    return self.bgra.shape[0]
+
+  @property
+  def bbox(self):
+    return (self.left, self.top, self.left + self.width, self.top + self.height)
+
+  def contains(self, bbox):
+    return (bbox[0] >= self.left and bbox[1] >= self.top
+            and bbox[2] <= self.left + self.width and bbox[3] <= self.top + self.height)
+
+  def crop(self, bbox):
+    """View of the (left, top, right, bottom) screen rectangle, None if outside this frame."""
+    if not self.contains(bbox):
+      return None
+    rows = slice(bbox[1] - self.top, bbox[3] - self.top)
+    cols = slice(bbox[0] - self.left, bbox[2] - self.left)
+    cropped = Frame(self.bgra[rows, cols], bbox[0], bbox[1])
+    if self._bgr is not None:
+      cropped._bgr = self._bgr[rows, cols]
+    if self._gray is not None:
+      cropped._gray = self._gray[rows, cols]
+    return cropped
+
+  def bgr(self) -> np.ndarray:
+    if self._bgr is None:
+      self._bgr = cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2BGR)
+    return self._bgr
+
+  def gray(self) -> np.ndarray:
+    if self._gray is None:
+      self._gray = cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2GRAY)
+    return self._gray
+
+  def rgb(self) -> np.ndarray:
+    return cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2RGB)
+
+  def pyramid(self, level) -> np.ndarray:
+    """BGR image halved `level` times with pyrDown, built once per frame."""
+    if self._pyramid is None:
+      self._pyramid = [self.bgr()]
+    while len(self._pyramid) <= level:
+      self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+    return self._pyramid[level]
+
+# One capture session per thread, mss handles can't be shared across threads
+_session_context = threading.local()
+_sessions = []
+_sessions_lock = threading.Lock()
+
+class CaptureSession:
+  """Long-lived mss session of one thread, with reusable BGRA buffers and its grab count and latency."""
+
+  def __init__(self):
+    self.sct = mss.mss()
+    self.buffers = {}
+    self.grabs = 0
+    self.total_time = 0.0
+    self.last_time = 0.0
+    self.max_time = 0.0
+
+  def screen_bbox(self):
+    monitor = self.sct.monitors[1]
+    return (monitor["left"], monitor["top"], monitor["left"] + monitor["width"], monitor["top"] + monitor["height"])
+
+  def _monitor(self, bbox):
+    return {
+      "left": bbox[0],
+      "top": bbox[1],
+      "width": bbox[2] - bbox[0],
+      "height": bbox[3] - bbox[1]
     }
-    img = sct.grab(monitor)
-    img_np = np.array(img)
-    img_rgb = img_np[:, :, :3][:, :, ::-1]
-    return Image.fromarray(img_rgb)
\ No newline at end of file
+
+  def buffer(self, key, shape):
+    """BGRA array named `key`, kept and handed out again while the shape stays the same."""
+    buf = self.buffers.get(key)
+    if buf is None or buf.shape != shape:
+      buf = np.empty(shape, np.uint8)
+      self.buffers[key] = buf
+    return buf
+
+  def grab_into(self, out, bbox=None):
+    """Copy the BGRA pixels of bbox (the whole screen if None) into `out`, which has to fit them."""
+    if bbox is None:
+      bbox = self.screen_bbox()
+    start = time.perf_counter()
+    img = self.sct.grab(self._monitor(bbox))
+    np.copyto(out, np.frombuffer(img.raw, np.uint8).reshape(img.height, img.width, 4))
+    self._count(time.perf_counter() - start)
+    return out
+
+  def _count(self, elapsed):
+    self.grabs += 1
+    self.total_time += elapsed
+    self.last_time = elapsed
+    self.max_time = max(self.max_time, elapsed)
+
+  def grab_frame(self, bbox=None) -> Frame:
+    """Frame viewing mss' own BGRA buffer, no copy is made."""
+    if bbox is None:
+      bbox = self.screen_bbox()
+    start = time.perf_counter()
+    img = self.sct.grab(self._monitor(bbox))
+    bgra = np.frombuffer(img.raw, np.uint8).reshape(img.height, img.width, 4)
+    self._count(time.perf_counter() - start)
+    return Frame(bgra, bbox[0], bbox[1])
+
+  def grab_buffered(self, bbox=None, key="frame") -> Frame:
+    """Frame of bbox grabbed into the buffer named `key`, overwritten by the next grab with that key."""
+    if bbox is None:
+      bbox = self.screen_bbox()
+    out = self.buffer(key, (bbox[3] - bbox[1], bbox[2] - bbox[0], 4))
+    return Frame(self.grab_into(out, bbox), bbox[0], bbox[1])
+
+  def reset_stats(self):
+    self.grabs = 0
+    self.total_time = 0.0
+    self.last_time = 0.0
+    self.max_time = 0.0
+
+  def close(self):
+    self.sct.close()
+    self.buffers.clear()
+
+def get_capture_session() -> CaptureSession:
+  session = getattr(_session_context, "session", None)
+  if session is None:
+    session = CaptureSession()
+    _session_context.session = session
+    with _sessions_lock:
+      _sessions.append(session)
+  return session
+
+def close_capture_session():
+  """Release the calling thread's session, call it before the thread exits."""
+  session = getattr(_session_context, "session", None)
+  if session is None:
+    return
+  _session_context.session = None
+  with _sessions_lock:
+    _sessions.remove(session)
+  session.close()
+
+def capture_stats():
+  """Grab count and latency (ms) summed over every live session."""
+  with _sessions_lock:
+    sessions = list(_sessions)
+  grabs = sum(s.grabs for s in sessions)
+  total_time = sum(s.total_time for s in sessions)
+  return {
+    "grabs": grabs,
+    "total_ms": total_time * 1000,
+    "avg_ms": total_time * 1000 / grabs if grabs else 0.0,
+    "max_ms": max((s.max_time for s in sessions), default=0.0) * 1000,
+  }
+
+def reset_capture_stats():
+  with _sessions_lock:
+    for session in _sessions:
+      session.reset_stats()
+
+class FrameSource:
+  """Where frames come from. Every capture of the bot goes through the active source."""
+
+  # live sources show a moving screen, so polling for something makes sense
+  live = True
+  # recording sources want every cycle's whole screen, see record()
+  recording = False
+
+  def grab(self, bbox=None) -> Frame:
+    """Frame of bbox (left, top, right, bottom), the whole screen if None."""
+    raise NotImplementedError
+
+  def grab_cycle(self, bbox=None) -> Frame:
+    """Frame of a bot cycle, only used until the next cycle's frame is captured."""
+    return self.grab(bbox)
+
+  def next_frame(self):
+    """Called once per bot cycle, before the cycle's frame is captured."""
+
+  def record(self, frame):
+    """Called once per bot cycle with the frame captured for it."""
+
+  def close(self):
+    pass
+
+class LiveFrameSource(FrameSource):
+  """Desktop capture through the calling thread's CaptureSession.
+
+  With `record_dir` every cycle's full screen is also saved as a PNG, the
+  directory can then be played back with ReplayFrameSource. The PNGs are
+  written by a background thread, cycles coming faster than it keeps up with
+  aren't recorded.
+  """
+
+  # frames waiting for the writer before new ones are dropped
+  MAX_PENDING_FRAMES = 4
+
+  def __init__(self, record_dir=None):
+    self.record_dir = Path(record_dir) if record_dir else None
+    self.recording = self.record_dir is not None
+    self.recorded = 0
+    self.dropped = 0
+    self._pending = None
+    self._writer = None
+    if self.record_dir:
+      self.record_dir.mkdir(parents=True, exist_ok=True)
+      # keep numbering after an earlier run so restarts append to the session
+      self.recorded = len(list(self.record_dir.glob("frame_*.png")))
+
+  def grab(self, bbox=None) -> Frame:
+    return get_capture_session().grab_frame(bbox)
+
+  def grab_cycle(self, bbox=None) -> Frame:
+    # every cycle reuses the same array instead of keeping mss' per grab one alive
+    return get_capture_session().grab_buffered(bbox, key="cycle")
+
+  def record(self, frame):
+    if not self.recording:
+      return
+    if self._writer is None:
+      self._pending = queue.Queue(self.MAX_PENDING_FRAMES)
+      self._writer = threading.Thread(target=self._write_frames, daemon=True)
+      self._writer.start()
+    try:
+      # the frame views mss' buffer, the writer gets its own copy
+      self._pending.put_nowait((self.recorded, frame.bgra.copy()))
+    except queue.Full:
+      self.dropped += 1
+      return
+    self.recorded += 1
+
+  def _write_frames(self):
+    while True:
+      item = self._pending.get()
+      if item is None:
+        return
+      index, bgra = item
+      # fastest PNG compression, the files only have to be lossless
+      cv2.imwrite(str(self.record_dir / f"frame_{index:06d}.png"),
+                  cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR), [cv2.IMWRITE_PNG_COMPRESSION, 1])
+
+  def close(self):
+    if self._writer is None:
+      return
+    self._pending.put(None)
+    self._writer.join()
+    self._writer = None
+    if self.dropped:
+      warning(f"{self.dropped} frames weren't recorded, writing them couldn't keep up with the bot.")
+
+class ReplayFrameSource(FrameSource):
+  """Plays back full screen PNGs from a directory or a .zip archive, in name order.
+
+  Each bot cycle (next_frame) moves to the next recorded screen. At the end the
+  last screen stays up and `finished` is set, unless `loop` is on.
+  """
+
+  live = False
+
+  def __init__(self, path, loop=False):
+    self.path = Path(path)
+    self.loop = loop
+    self.finished = False
+    self.index = -1
+    self._decoded = None
+    if zipfile.is_zipfile(self.path):
+      self.archive = zipfile.ZipFile(self.path)
+      self.names = sorted(n for n in self.archive.namelist() if n.lower().endswith(".png"))
+    else:
+      self.archive = None
+      self.names = sorted(str(p) for p in self.path.glob("*.png"))
+    if not self.names:
+      raise FileNotFoundError(f"No recorded frames in {self.path}")
+
+  def __len__(self):
+    return len(self.names)
+
+  def _read(self, name) -> np.ndarray:
+    if self.archive:
+      data = np.frombuffer(self.archive.read(name), np.uint8)
+    else:
+      data = np.fromfile(name, np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    if image.ndim == 2:
+      return cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+    if image.shape[2] == 3:
+      return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    return image
+
+  def current(self) -> Frame:
+    index = max(self.index, 0)
+    if self._decoded is None or self._decoded[0] != index:
+      self._decoded = (index, Frame(self._read(self.names[index])))
+    return self._decoded[1]
+
+  def current_name(self):
+    return self.names[max(self.index, 0)]
+
+  def grab(self, bbox=None) -> Frame:
+    frame = self.current()
+    if bbox is None:
+      return frame
+    cropped = frame.crop(bbox)
+    if cropped is None:
+      raise ValueError(f"{bbox} is outside the recorded {frame.width}x{frame.height} screen")
+    return cropped
+
+  def next_frame(self):
+    if self.index + 1 < len(self.names):
+      self.index += 1
+    elif self.loop:
+      self.index = 0
+    else:
+      self.index = len(self.names) - 1
+      self.finished = True
+
+  def close(self):
+    if self.archive:
+      self.archive.close()
+
+_frame_source = LiveFrameSource()
+
+def get_frame_source() -> FrameSource:
+  return _frame_source
+
+def set_frame_source(source: FrameSource):
+  global _frame_source
+  _frame_source.close()
+  _frame_source = source
+  invalidate_frame()
+
+def region_to_bbox(region):
+  """(x, y, w, h) -> (left, top, right, bottom)"""
+  x, y, w, h = region
+  return (x, y, x + w, y + h)
+
+def union_bbox(bboxes):
+  """Smallest (left, top, right, bottom) rectangle covering every bbox."""
+  return (
+    min(b[0] for b in bboxes),
+    min(b[1] for b in bboxes),
+    max(b[2] for b in bboxes),
+    max(b[3] for b in bboxes),
+  )
+
+def capture_frame(bboxes=None) -> Frame:
+  """Grab the screen once for the current cycle.
+
+  `bboxes` is a list of (left, top, right, bottom) areas the cycle will probe,
+  only their bounding rectangle is captured. None captures the whole screen.
+  Every capture helper crops from this frame until invalidate_frame() is called.
+  """
+  # a recording keeps the whole screen so every probe can be replayed from it
+  bbox = union_bbox(bboxes) if bboxes and not _frame_source.recording else None
+  _frame_source.next_frame()
+  frame = _frame_source.grab_cycle(bbox)
+  _frame_source.record(frame)
+  _frame_context.frame = frame
+  _frame_context.full = bbox is None
+  return frame
+
+def invalidate_frame():
+  _frame_context.frame = None
+
+def current_frame():
+  return getattr(_frame_context, "frame", None)
+
+def grab_frame(bbox=None) -> Frame:
+  """Frame of bbox (left, top, right, bottom), cropped from the current frame when it covers it."""
+  frame = current_frame()
+  if bbox is None:
+    if frame is not None and _frame_context.full:
+      return frame
+    return _frame_source.grab()
+  bbox = tuple(int(v) for v in bbox)
+  if frame is not None:
+    cropped = frame.crop(bbox)
+    if cropped is not None:
+      return cropped
+  return _frame_source.grab(bbox)
+
+def enhance_contrast(gray: np.ndarray, factor=1.5) -> np.ndarray:
+  # same blend as PIL's ImageEnhance.Contrast: push pixels away from the mean gray
+  mean = int(gray.mean() + 0.5)
+  return cv2.addWeighted(gray, factor, gray, 0, mean * (1 - factor))
+
+def enhanced_screenshot(region=(0, 0, 1920, 1080), frame=None) -> np.ndarray:
+  """2x upscaled, contrast enhanced grayscale crop of region (x, y, w, h), ready for OCR.
+
+  Crops from `frame` when given, it has to cover the region.
+  """
+  bbox = region_to_bbox(region)
+  crop = frame.crop(bbox) if frame is not None else None
+  gray = (crop if crop is not None else grab_frame(bbox)).gray()
+  gray = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+  return enhance_contrast(gray, 1.5)
@@ -3,6 +3,7 @@ import pyautogui
 import time
 import core.state as state
 from .log import error
+from .screenshot import invalidate_frame
 
 def sleep(seconds=1):
   time.sleep(seconds * state.SLEEP_TIME_MULTIPLIER)
@@ -21,3 +22,4 @@ def drag_scroll(mousePos, to):
   pyautogui.moveRel(0, to, duration=0.25)
   pyautogui.mouseUp()
   pyautogui.click()
+  invalidate_frame()
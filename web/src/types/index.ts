@@ -23,6 +23,9 @@ export type Config = {
   priority_stat: string[];
   priority_weights: number[];
   sleep_time_multiplier: number;
+  cpu_budget_percent?: number;
+  ocr_workers?: number;
+  ocr_torch_threads?: number;
   skip_training_energy: number;
   never_rest_energy: number;
   skip_infirmary_unless_missing_energy: number;